@@ -0,0 +1,314 @@
+"""Per-job resource accounting.
+
+A JobMetrics is made active for the thread running a job; the helpers the
+job calls (run_command, S3 transfers, AI calls) charge their cost to it via
+get_job_metrics(). Stages are sequential: begin('split') closes the
+previous stage.
+"""
+import os
+import re
+import resource
+import signal
+import subprocess
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from cancellation import JobCancelled, get_cancel_token
+
+PROFILE_INTERVAL = float(os.getenv('JOB_PROFILE_INTERVAL', 0.01))
+PROFILE_MIN_SECONDS = float(os.getenv('JOB_PROFILE_MIN_SECONDS', 30))
+PROFILE_TOP_STACKS = 20
+
+_active = threading.local()
+
+
+def get_job_metrics():
+    """JobMetrics of the job running on this thread, or None"""
+    return getattr(_active, 'metrics', None)
+
+
+@contextmanager
+def charged_to(metrics):
+    """Charge work done on this (pool) thread to another thread's job"""
+    previous = get_job_metrics()
+    _active.metrics = metrics
+    try:
+        yield
+    finally:
+        _active.metrics = previous
+
+
+def begin_stage(name):
+    """Start a stage on the current job, if one is being accounted (stages are cancellation checkpoints)"""
+    token = get_cancel_token()
+    if token:
+        token.check()
+    metrics = get_job_metrics()
+    if metrics:
+        metrics.begin(name)
+
+
+class AccountedPopen(subprocess.Popen):
+    """Popen that reaps with wait4 to keep the child's own rusage"""
+    rusage = None
+
+    def _try_wait(self, wait_flags):
+        try:
+            pid, status, rusage = os.wait4(self.pid, wait_flags)
+        except ChildProcessError:
+            # Same as Popen: the child was reaped elsewhere (SIGCHLD ignored)
+            return (self.pid, 0)
+        if pid == self.pid:
+            self.rusage = rusage
+        return (pid, status)
+
+
+def ffmpeg_progress(stderr, duration):
+    """Fraction of the input ffmpeg got through, from its last `time=` stats line"""
+    if not duration or not isinstance(stderr, str):
+        return None
+    times = re.findall(r'time=(\d+):(\d+):(\d+(?:\.\d+)?)', stderr)
+    if not times:
+        return None
+    hours, minutes, seconds = times[-1]
+    return min(1.0, (int(hours) * 3600 + int(minutes) * 60 + float(seconds)) / duration)
+
+
+def run_command(cmd, timeout=None, text=True):
+    """subprocess.run(cmd, capture_output=True, text=text) charging the child to the current job.
+
+    The child leads its own process group so cancelling the job kills it
+    (and anything it spawned); run_command then raises JobCancelled.
+    """
+    token = get_cancel_token()
+    if token:
+        token.check()
+    before = resource.getrusage(resource.RUSAGE_CHILDREN)
+    process = AccountedPopen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=text,
+                             start_new_session=True)
+    if token:
+        token.add_process(process)
+    stdout = stderr = None
+    try:
+        with process:
+            try:
+                stdout, stderr = process.communicate(timeout=timeout)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.communicate()
+                raise
+    finally:
+        if token:
+            token.remove_process(process)
+        cpu_s = charge_child(process, before)
+    if token and token.cancelled and process.returncode == -signal.SIGKILL:
+        token.record_kill(cpu_s, ffmpeg_progress(stderr, token.media_duration))
+        raise JobCancelled(token.reason)
+    return subprocess.CompletedProcess(cmd, process.returncode, stdout, stderr)
+
+
+@contextmanager
+def piped_command(cmd, stderr=subprocess.DEVNULL):
+    """Run cmd with a stdin pipe for the duration of the with block, charged
+    and cancellable like run_command.
+
+    For input that is still arriving: the block writes to process.stdin as
+    it goes, closes it and waits. A child still running on exit is killed.
+    """
+    token = get_cancel_token()
+    if token:
+        token.check()
+    before = resource.getrusage(resource.RUSAGE_CHILDREN)
+    process = AccountedPopen(cmd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=stderr,
+                             start_new_session=True)
+    if token:
+        token.add_process(process)
+    try:
+        yield process
+    finally:
+        try:
+            process.stdin.close()
+        except BrokenPipeError:
+            pass
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+        if token:
+            token.remove_process(process)
+        cpu_s = charge_child(process, before)
+        if token and token.cancelled and process.returncode == -signal.SIGKILL:
+            token.record_kill(cpu_s)
+            raise JobCancelled(token.reason)
+
+
+def charge_child(process, before):
+    """Charge a reaped child's CPU and peak RSS to the current job; returns its CPU seconds"""
+    usage = process.rusage
+    if usage is None:
+        # No wait4 (e.g. gevent's Popen): process-wide delta, approximate
+        # when other jobs' children finish at the same time
+        after = resource.getrusage(resource.RUSAGE_CHILDREN)
+        user, system = after.ru_utime - before.ru_utime, after.ru_stime - before.ru_stime
+        max_rss = after.ru_maxrss if after.ru_maxrss > before.ru_maxrss else 0
+    else:
+        user, system, max_rss = usage.ru_utime, usage.ru_stime, usage.ru_maxrss
+    metrics = get_job_metrics()
+    if metrics:
+        metrics.add_child_usage(user, system, max_rss)
+    return user + system
+
+
+class SamplingProfiler:
+    """Samples one thread's Python stack at a fixed interval"""
+    def __init__(self, interval=PROFILE_INTERVAL):
+        self.interval = interval
+        self.samples = Counter()
+        self.total = 0
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def start(self, thread_id):
+        self.thread = threading.Thread(target=self.run, args=(thread_id,), daemon=True)
+        self.thread.start()
+
+    def run(self, thread_id):
+        while not self.stop_event.wait(self.interval):
+            frame = sys._current_frames().get(thread_id)
+            stack = []
+            while frame is not None and len(stack) < 12:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}")
+                frame = frame.f_back
+            if stack:
+                self.samples[' <- '.join(stack)] += 1
+                self.total += 1
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join()
+
+    def report(self):
+        return {
+            'interval_s': self.interval,
+            'samples': self.total,
+            'top_stacks': [
+                {'stack': stack, 'samples': count, 'percent': round(100 * count / self.total, 1)}
+                for stack, count in self.samples.most_common(PROFILE_TOP_STACKS)
+            ]
+        }
+
+
+class JobMetrics:
+    """Wall time, child CPU/RSS and bytes per stage, plus S3 and Gemini usage"""
+    def __init__(self, profile=False):
+        self.started = time.monotonic()
+        self.finished = None
+        self.stages = {}
+        self.current = None
+        self.current_started = None
+        self.s3 = {'bytes_downloaded': 0, 'bytes_uploaded': 0}
+        self.ai = {'calls': 0, 'latency_s': 0.0, 'prompt_tokens': 0, 'output_tokens': 0}
+        self.profiler = SamplingProfiler() if profile else None
+        self.cancellation = None
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def active(self):
+        """Make this the current thread's job metrics for the duration of the job"""
+        previous = get_job_metrics()
+        _active.metrics = self
+        if self.profiler:
+            self.profiler.start(threading.get_ident())
+        try:
+            yield self
+        finally:
+            self.finish()
+            if self.profiler:
+                self.profiler.stop()
+            _active.metrics = previous
+
+    def begin(self, name):
+        """Start a stage, closing the previous one"""
+        self.end()
+        with self.lock:
+            self.current = self.stages.setdefault(name, {
+                'wall_s': 0.0, 'cpu_user_s': 0.0, 'cpu_sys_s': 0.0, 'max_rss_kb': 0,
+                'child_processes': 0, 'bytes_read': 0, 'bytes_written': 0
+            })
+            self.current_started = time.monotonic()
+
+    def end(self):
+        with self.lock:
+            if self.current is not None:
+                self.current['wall_s'] += time.monotonic() - self.current_started
+                self.current = None
+
+    def finish(self):
+        self.end()
+        if self.finished is None:
+            self.finished = time.monotonic()
+
+    def stage(self):
+        if self.current is None:
+            self.begin('other')
+        return self.current
+
+    def add_child_usage(self, user, system, max_rss_kb):
+        stage = self.stage()
+        with self.lock:
+            stage['cpu_user_s'] += user
+            stage['cpu_sys_s'] += system
+            stage['max_rss_kb'] = max(stage['max_rss_kb'], max_rss_kb)
+            stage['child_processes'] += 1
+
+    def add_io(self, read=0, written=0):
+        stage = self.stage()
+        with self.lock:
+            stage['bytes_read'] += read
+            stage['bytes_written'] += written
+
+    def add_s3(self, downloaded=0, uploaded=0):
+        with self.lock:
+            self.s3['bytes_downloaded'] += downloaded
+            self.s3['bytes_uploaded'] += uploaded
+
+    def add_ai_call(self, latency, response=None, tokens=None):
+        """tokens: (prompt, output) when there is no response of the job's own (batched calls)"""
+        usage = getattr(response, 'usage_metadata', None)
+        prompt_tokens, output_tokens = tokens or (getattr(usage, 'prompt_token_count', 0) or 0,
+                                                  getattr(usage, 'candidates_token_count', 0) or 0)
+        with self.lock:
+            self.ai['calls'] += 1
+            self.ai['latency_s'] += latency
+            self.ai['prompt_tokens'] += prompt_tokens
+            self.ai['output_tokens'] += output_tokens
+
+    def report(self):
+        """Accounting snapshot (JSON-serializable)"""
+        with self.lock:
+            stages = {name: {k: round(v, 3) if isinstance(v, float) else v for k, v in stage.items()}
+                      for name, stage in self.stages.items()}
+            if self.current is not None:
+                name = next(n for n, s in self.stages.items() if s is self.current)
+                stages[name]['wall_s'] = round(self.current['wall_s'] + time.monotonic() - self.current_started, 3)
+            wall = (self.finished or time.monotonic()) - self.started
+            report = {
+                'wall_s': round(wall, 3),
+                'stages': stages,
+                'cpu_user_s': round(sum(s['cpu_user_s'] for s in self.stages.values()), 3),
+                'cpu_sys_s': round(sum(s['cpu_sys_s'] for s in self.stages.values()), 3),
+                'max_rss_kb': max((s['max_rss_kb'] for s in self.stages.values()), default=0),
+                'bytes_read': sum(s['bytes_read'] for s in self.stages.values()),
+                'bytes_written': sum(s['bytes_written'] for s in self.stages.values()),
+                's3': dict(self.s3),
+                'ai': dict(self.ai, latency_s=round(self.ai['latency_s'], 3))
+            }
+            if self.cancellation:
+                report['cancellation'] = dict(self.cancellation)
+        if self.profiler and self.finished is not None and wall >= PROFILE_MIN_SECONDS:
+            report['profile'] = self.profiler.report()
+        return report
@@ -0,0 +1,257 @@
+"""Cross-job micro-batching of AI segment metadata requests.
+
+Jobs submit metadata requests to one shared AIBatchDispatcher. Requests
+arriving within a short window (or until the size cap) are sent as one
+multi-item prompt and the response is split back per job. Items that fail
+validation, or a whole batch whose response can't be parsed, fall back to
+individual calls, run on the dispatcher's own fallback pool so they don't
+hold up the next batches. Each fallback gets the budget its job submitted
+with, so it goes through the caller's normal (hedged, budgeted) generate.
+
+Each request's future resolves to (segments, (prompt_tokens, output_tokens)):
+a batch's token usage is divided among its jobs by requested segment count,
+so per-job accounting still sees it.
+
+The dispatcher only needs a `generate(prompt, budget=None) -> response` callable
+(response.text, response.usage_metadata), so it runs against LocalFakeModel
+(AI_MODEL=fake) without network access.
+"""
+import json
+import re
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+
+
+class RateLimiter:
+    """Token bucket: `rate_per_minute` calls, bursts up to `burst`"""
+    def __init__(self, rate_per_minute, burst=None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = burst or max(1, int(rate_per_minute / 6))
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, timeout=None):
+        """Take a token, waiting up to `timeout` seconds (None = forever); False on timeout"""
+        if self.rate <= 0:
+            return True
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return True
+                wait = (1 - self.tokens) / self.rate
+            if deadline is not None:
+                if time.monotonic() + wait > deadline:
+                    return False
+            time.sleep(wait)
+
+
+def build_segment_metadata_prompt(segment_count):
+    """Prompt for one video's segment titles/descriptions"""
+    return f"""
+            Generate engaging titles and descriptions for {segment_count} video segments.
+            Each segment is approximately 2 minutes long.
+
+            Respond in JSON format:
+            {{
+                "segments": [
+                    {{
+                        "title": "creative title for segment 1",
+                        "description": "engaging description",
+                        "duration": "2:00"
+                    }},
+                    ...
+                ]
+            }}
+            """
+
+
+def build_batch_prompt(items):
+    """Prompt for several videos' segment metadata at once"""
+    videos = '\n'.join(f'            - id "{item_id}": {count} segments' for item_id, count in items)
+    return f"""
+            Generate engaging titles and descriptions for the segments of each of the
+            following {len(items)} videos. Each segment is approximately 2 minutes long.
+
+            Videos:
+{videos}
+
+            Respond in JSON format, with exactly one entry per video id and exactly the
+            requested number of segments for each:
+            {{
+                "items": [
+                    {{
+                        "id": "video id",
+                        "segments": [
+                            {{
+                                "title": "creative title",
+                                "description": "engaging description",
+                                "duration": "2:00"
+                            }},
+                            ...
+                        ]
+                    }},
+                    ...
+                ]
+            }}
+            """
+
+
+def extract_json(text):
+    """First {...} object in a model response, or None"""
+    try:
+        start = text.find('{')
+        end = text.rfind('}') + 1
+        if start != -1 and end != 0:
+            return json.loads(text[start:end])
+    except (ValueError, AttributeError):
+        pass
+    return None
+
+
+def token_usage(response):
+    """(prompt_tokens, output_tokens) of a model response"""
+    usage = getattr(response, 'usage_metadata', None)
+    return (getattr(usage, 'prompt_token_count', 0) or 0, getattr(usage, 'candidates_token_count', 0) or 0)
+
+
+def valid_segments(segments, segment_count):
+    """Segment list has the requested length and a title for every entry"""
+    return (isinstance(segments, list) and len(segments) == segment_count
+            and all(isinstance(s, dict) and isinstance(s.get('title'), str) and s['title'].strip()
+                    for s in segments))
+
+
+class AIBatchDispatcher:
+    def __init__(self, generate, window=0.2, max_items=8, concurrency=4, fallback_executor=None):
+        # Fallbacks block on generate(), which waits on the caller's own pool: keep them off it
+        self.generate = generate
+        self.window = window
+        self.max_items = max_items
+        self.pending = []
+        self.condition = threading.Condition()
+        self.executor = ThreadPoolExecutor(max_workers=concurrency)
+        self.fallback_executor = fallback_executor or ThreadPoolExecutor(max_workers=concurrency * max_items)
+        self.stats = {'requests': 0, 'batches': 0, 'batched_items': 0, 'individual_calls': 0,
+                      'fallbacks': 0}
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def submit(self, segment_count, budget=None):
+        """Queue one job's metadata request; the Future resolves to (segments, tokens).
+
+        `budget` is passed to generate() if the request falls back to its own call.
+        Cancel the Future to drop the request if it hasn't been sent yet.
+        """
+        future = Future()
+        with self.condition:
+            self.pending.append((uuid.uuid4().hex[:8], segment_count, future, time.monotonic(), budget))
+            self.stats['requests'] += 1
+            self.condition.notify()
+        return future
+
+    def run(self):
+        """Collect requests for `window` seconds after the first (or `max_items`), then dispatch"""
+        while True:
+            with self.condition:
+                while not self.pending:
+                    self.condition.wait()
+                flush_at = self.pending[0][3] + self.window
+                while len(self.pending) < self.max_items and time.monotonic() < flush_at:
+                    self.condition.wait(flush_at - time.monotonic())
+                batch = self.pending[:self.max_items]
+                del self.pending[:self.max_items]
+            self.executor.submit(self.dispatch, batch)
+
+    def dispatch(self, batch):
+        batch = [item for item in batch if item[2].set_running_or_notify_cancel()]
+        if not batch:
+            return
+        if len(batch) == 1:
+            self.call_individually(batch)
+            return
+
+        try:
+            response = self.generate(build_batch_prompt([(item[0], item[1]) for item in batch]))
+        except Exception as e:
+            for _, _, future, _, _ in batch:
+                future.set_exception(e)
+            return
+        self.count('batches')
+        self.count('batched_items', len(batch))
+
+        data = extract_json(response.text)
+        results = {}
+        if isinstance(data, dict) and isinstance(data.get('items'), list):
+            results = {entry.get('id'): entry.get('segments')
+                       for entry in data['items'] if isinstance(entry, dict)}
+        prompt_tokens, output_tokens = token_usage(response)
+        total = sum(item[1] for item in batch)
+        retry = []
+        for item_id, count, future, queued, budget in batch:
+            tokens = (round(prompt_tokens * count / total), round(output_tokens * count / total))
+            if valid_segments(results.get(item_id), count):
+                future.set_result((results[item_id], tokens))
+            else:
+                retry.append((item_id, count, future, queued, budget, tokens))
+        if retry:
+            self.count('fallbacks', len(retry))
+            self.call_individually(retry)
+
+    def call_individually(self, items):
+        """One call per item, each on the fallback executor"""
+        for item in items:
+            self.fallback_executor.submit(self.call_one, *item)
+
+    def call_one(self, item_id, count, future, queued, budget, tokens=(0, 0)):
+        self.count('individual_calls')
+        try:
+            response = self.generate(build_segment_metadata_prompt(count), budget)
+            data = extract_json(response.text)
+            prompt_tokens, output_tokens = token_usage(response)
+            future.set_result((data.get('segments', []) if isinstance(data, dict) else [],
+                               (tokens[0] + prompt_tokens, tokens[1] + output_tokens)))
+        except Exception as e:
+            future.set_exception(e)
+
+    def count(self, stat, n=1):
+        with self.condition:
+            self.stats[stat] += n
+
+    def get_stats(self):
+        with self.condition:
+            return dict(self.stats, pending=len(self.pending))
+
+
+class LocalFakeModel:
+    """Offline stand-in for the Gemini model (AI_MODEL=fake): answers every
+    prompt type GoogleAIService sends with well-formed JSON."""
+    def __init__(self, latency=0.05):
+        self.latency = latency
+
+    def generate_content(self, prompt, request_options=None):
+        time.sleep(self.latency)
+        if isinstance(prompt, list):
+            # Multimodal request: answer from the text parts
+            prompt = '\n'.join(part for part in prompt if isinstance(part, str))
+        segments = lambda n: [{'title': f'Part {i + 1}', 'description': 'Local fake segment', 'duration': '2:00'}
+                              for i in range(n)]
+        items = re.findall(r'id "([^"]+)": (\d+) segments', prompt)
+        if items:
+            data = {'items': [{'id': item_id, 'segments': segments(int(count))} for item_id, count in items]}
+        else:
+            match = re.search(r'(\d+) (?:video )?segments', prompt)
+            count = int(match.group(1)) if match else 1
+            if 'video_title' in prompt:
+                data = {'video_title': 'Local Fake Video', 'segments': [s['title'] for s in segments(count)],
+                        'strategy': 'Fixed-length segments', 'description': 'Generated offline'}
+            else:
+                data = {'segments': segments(count)}
+        return type('FakeResponse', (), {'text': json.dumps(data), 'usage_metadata': None})()
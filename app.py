@@ -417,22 +417,49 @@
 
 
 
-from flask import Flask, render_template, request, send_file, jsonify, session
+from flask import Flask, render_template, request, send_file, send_from_directory, jsonify, session, redirect
 from werkzeug.utils import secure_filename
+from werkzeug.exceptions import ClientDisconnected
 import os
+import sys
 import uuid
 import subprocess
 import zipfile
-from datetime import datetime
+from datetime import datetime, timedelta
 import threading
+import select
+import socket
 import shutil
+import tempfile
 import google.generativeai as genai
 from dotenv import load_dotenv
 import json
 import time
+import hashlib
+import re
+import csv
 import boto3
+from boto3.exceptions import S3UploadFailedError
+from boto3.s3.transfer import TransferConfig, create_transfer_manager
+from s3transfer.exceptions import S3DownloadFailedError
+from s3transfer.subscribers import BaseSubscriber
 from botocore.exceptions import ClientError
 import requests
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED
+from collections import deque
+from job_queue import create_job_queue
+from accounting import JobMetrics, begin_stage, get_job_metrics, piped_command, run_command
+from ai_dispatcher import AIBatchDispatcher, LocalFakeModel, RateLimiter, build_segment_metadata_prompt
+from preflight import (
+    PreflightError, preflight_file, preflight_s3_object, sniff_streamable, summarize, video_keyframe_times
+)
+from frame_sampler import describe_frames, sample_keyframes
+from cancellation import (
+    CANCEL_POLL_INTERVAL, CancelToken, JobCancelled, cancel_job, get_cancel_token, register_job,
+    unregister_job, wait_cancellable
+)
+from source_cache import SourceCache, SourceCacheBusy, SourceHandle
+from PIL import Image
 
 # Load environment variables
 load_dotenv()
@@ -443,6 +470,11 @@ app.config['MAX_CONTENT_LENGTH'] = 100 * 1024 * 1024  # 100MB limit for metadata
 app.config['UPLOAD_FOLDER'] = 'uploads'
 app.config['TEMP_FOLDER'] = 'temp'
 
+# Local downloads: optionally let the front proxy stream the bytes (sendfile)
+DOWNLOAD_OFFLOAD = os.getenv('DOWNLOAD_OFFLOAD', '')  # '', 'nginx' (X-Accel-Redirect) or 'sendfile' (X-Sendfile)
+DOWNLOAD_ACCEL_PREFIX = os.getenv('DOWNLOAD_ACCEL_PREFIX', '/protected-downloads')
+app.config['USE_X_SENDFILE'] = DOWNLOAD_OFFLOAD == 'sendfile'
+
 # Ensure directories exist
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 os.makedirs(app.config['TEMP_FOLDER'], exist_ok=True)
@@ -458,6 +490,16 @@ AWS_SECRET_ACCESS_KEY = os.getenv('AWS_SECRET_ACCESS_KEY')
 AWS_REGION = os.getenv('AWS_REGION', 'us-east-1')
 S3_BUCKET = os.getenv('S3_BUCKET')
 
+# Streaming ZIP -> S3 multipart packaging
+S3_STREAM_PACKAGING = os.getenv('S3_STREAM_PACKAGING', 'true').lower() == 'true'
+S3_PART_SIZE = int(os.getenv('S3_PART_SIZE', 8 * 1024 * 1024))
+S3_UPLOAD_CONCURRENCY = int(os.getenv('S3_UPLOAD_CONCURRENCY', 4))
+
+# Node-local cache of downloaded source videos (key + ETag), shared by all processes; 0 bytes = off
+SOURCE_CACHE_DIR = os.getenv('SOURCE_CACHE_DIR', 'source_cache')
+SOURCE_CACHE_MAX_BYTES = int(os.getenv('SOURCE_CACHE_MAX_BYTES', 5 * 1024 ** 3))
+source_cache = SourceCache(SOURCE_CACHE_DIR, SOURCE_CACHE_MAX_BYTES) if SOURCE_CACHE_MAX_BYTES > 0 else None
+
 # Initialize S3 client
 s3_client = None
 if all([AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY, S3_BUCKET]):
@@ -468,26 +510,308 @@ if all([AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY, S3_BUCKET]):
         region_name=AWS_REGION
     )
 
-ALLOWED_EXTENSIONS = {'mp4', 'avi', 'mov', 'mkv', 'wmv', 'flv', 'webm', 'm4v'}
+# Shared job queue (web nodes enqueue, `python -m worker` processes); unset = process inline
+JOB_QUEUE_BACKEND = os.getenv('JOB_QUEUE_BACKEND')  # 'sqlite' or 'redis'
+JOB_QUEUE_PATH = os.getenv('JOB_QUEUE_PATH', 'jobs.sqlite3')
+JOB_QUEUE_URL = os.getenv('JOB_QUEUE_URL')
+JOB_VISIBILITY_TIMEOUT = int(os.getenv('JOB_VISIBILITY_TIMEOUT', 120))
+JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', 3))
+job_queue = create_job_queue(JOB_QUEUE_BACKEND, JOB_QUEUE_PATH, JOB_QUEUE_URL)
+
+ALLOWED_EXTENSIONS = {'mp4', 'avi', 'mov', 'mkv', 'wmv', 'flv', 'webm', 'm4v', 'ts'}
+
+# MP4/MOV header preflight (no ffprobe, no full download); other containers go straight to ffprobe
+PREFLIGHT_ENABLED = os.getenv('PREFLIGHT_ENABLED', 'true').lower() == 'true'
+SEGMENT_DURATION = 120  # 2 minutes
+# Result ZIP entries that are already compressed: DEFLATE would only burn CPU on them
+ZIP_STORED_EXTENSIONS = {'.mp4', '.m4s', '.ts', '.mov', '.jpg'}
+
+# Streaming ingest (/ingest): MKV/WebM/TS/fragmented MP4 are split while the upload is still arriving
+INGEST_CHUNK_SIZE = int(os.getenv('INGEST_CHUNK_SIZE', 256 * 1024))  # reads block until a chunk is full
+INGEST_SNIFF_BYTES = int(os.getenv('INGEST_SNIFF_BYTES', 4 * 1024 * 1024))  # enough for an fMP4 moov
+INGEST_MAX_BYTES = int(os.getenv('INGEST_MAX_BYTES', 1024 ** 3))
+INGEST_POLL_INTERVAL = 0.2  # segment list polling once the upload is complete
+
+# AI call deadlines: total seconds a job may wait on Gemini, hedging, circuit breaker
+AI_JOB_BUDGET = float(os.getenv('AI_JOB_BUDGET', 20))
+AI_HEDGE_ENABLED = os.getenv('AI_HEDGE_ENABLED', 'true').lower() == 'true'
+AI_HEDGE_MIN_DELAY = float(os.getenv('AI_HEDGE_MIN_DELAY', 2))
+AI_BREAKER_THRESHOLD = int(os.getenv('AI_BREAKER_THRESHOLD', 5))
+AI_BREAKER_COOLDOWN = float(os.getenv('AI_BREAKER_COOLDOWN', 60))
+# Per-job accounting (always returned with the job result)
+JOB_PROFILING = os.getenv('JOB_PROFILING', 'false').lower() == 'true'
+ACCOUNTING_IN_METADATA = os.getenv('ACCOUNTING_IN_METADATA', 'false').lower() == 'true'
+
+# Shared AI dispatcher: batches concurrent jobs' metadata requests into one prompt
+AI_MODEL = os.getenv('AI_MODEL', 'gemini')  # 'fake' = offline LocalFakeModel
+AI_VISION_MODEL = os.getenv('AI_VISION_MODEL', 'gemini-1.5-flash')  # sampled keyframes go to this one
+AI_BATCHING_ENABLED = os.getenv('AI_BATCHING_ENABLED', 'true').lower() == 'true'
+AI_BATCH_WINDOW = float(os.getenv('AI_BATCH_WINDOW', 0.2))
+AI_BATCH_MAX_ITEMS = int(os.getenv('AI_BATCH_MAX_ITEMS', 8))
+AI_RATE_LIMIT_RPM = float(os.getenv('AI_RATE_LIMIT_RPM', 60))  # 0 = unlimited
+
+ai_executor = ThreadPoolExecutor(max_workers=int(os.getenv('AI_MAX_CONCURRENCY', 16)))
+
+def run_blocking(func, *args, **kwargs):
+    """Run a call that can't cooperate with gevent (e.g. gRPC) on a real OS thread.
+
+    Under the gevent worker (WORKER_MODE=gevent) subprocess and socket I/O
+    already yield; this keeps the remaining blocking calls from stalling
+    every other request held by the worker. Under sync workers it is a
+    plain call.
+    """
+    if 'gevent' in sys.modules:
+        from gevent import monkey, get_hub
+        if monkey.is_module_patched('socket'):
+            return get_hub().threadpool.apply(func, args, kwargs)
+    return func(*args, **kwargs)
+
+# Preview thumbnails / sprite sheets (generated in the same ffmpeg pass as the split)
+PREVIEWS_ENABLED = os.getenv('PREVIEWS_ENABLED', 'true').lower() == 'true'
+PREVIEW_THUMB_WIDTH = int(os.getenv('PREVIEW_THUMB_WIDTH', 160))
+SPRITE_COLUMNS = int(os.getenv('SPRITE_COLUMNS', 5))
+SPRITE_MAX_TILES = int(os.getenv('SPRITE_MAX_TILES', 100))
+
+# Proxy renditions (encoded from the same decode as the split)
+RENDITION_PRESETS = {
+    '480p': {'height': 480, 'video_bitrate': '800k', 'bufsize': '1600k', 'audio_bitrate': '96k'},
+    '720p': {'height': 720, 'video_bitrate': '2500k', 'bufsize': '5000k', 'audio_bitrate': '128k'},
+    '1080p': {'height': 1080, 'video_bitrate': '5000k', 'bufsize': '10000k', 'audio_bitrate': '160k'}
+}
+RENDITION_TIMEOUT = int(os.getenv('RENDITION_TIMEOUT', 1800))
+
+# HLS streaming output (stream copy, same ffmpeg pass as the split)
+OUTPUT_MODES = {'zip', 'hls'}
+HLS_SEGMENT_TIME = int(os.getenv('HLS_SEGMENT_TIME', 6))
+HLS_SEGMENT_TYPE = os.getenv('HLS_SEGMENT_TYPE', 'fmp4')  # 'fmp4' or 'mpegts'
+HLS_BYTERANGE = os.getenv('HLS_BYTERANGE', 'false').lower() == 'true'
+HLS_PUBLIC_BASE_URL = os.getenv('HLS_PUBLIC_BASE_URL')  # CDN / public bucket URL
+HLS_SIGNED_URL_EXPIRATION = int(os.getenv('HLS_SIGNED_URL_EXPIRATION', 6 * 3600))  # private bucket playback
+HLS_CHAPTER_CLASS = 'com.aivideosplitter.chapter'
+# RFC 6381 codec strings for the master playlist's CODECS, from ffprobe's profile names
+H264_PROFILES = {  # profile_idc, constraint flags
+    'Baseline': (0x42, 0x00), 'Constrained Baseline': (0x42, 0xE0), 'Main': (0x4D, 0x40),
+    'Extended': (0x58, 0x00), 'High': (0x64, 0x00), 'High 10': (0x6E, 0x00),
+    'High 4:2:2': (0x7A, 0x00), 'High 4:4:4 Predictive': (0xF4, 0x00)
+}
+HEVC_PROFILES = {'Main': '1.6', 'Main 10': '2.4'}  # profile_idc.compatibility flags
+AAC_OBJECT_TYPES = {'LC': 2, 'HE-AAC': 5, 'HE-AACv2': 29}
+HLS_CONTENT_TYPES = {
+    '.m3u8': 'application/vnd.apple.mpegurl',
+    '.m4s': 'video/iso.segment',
+    '.mp4': 'video/mp4',
+    '.ts': 'video/mp2t',
+    '.json': 'application/json'
+}
+
+class AITimeoutError(Exception):
+    """AI call did not answer within the job's AI budget"""
+
+class AICircuitOpenError(Exception):
+    """AI calls are short-circuited to the fallback during the breaker cool-down"""
+
+class AIBudget:
+    """Seconds a single job may spend waiting on AI calls, across all of them"""
+    def __init__(self, seconds=None):
+        self.remaining = AI_JOB_BUDGET if seconds is None else seconds
+    
+    def deadline(self):
+        return time.monotonic() + max(self.remaining, 0)
+    
+    def spend(self, seconds):
+        self.remaining -= seconds
+
+class AIDeadline(AIBudget):
+    """What is left of a job's budget for a call made on its behalf (a batch fallback): ends at a fixed time"""
+    def __init__(self, deadline):
+        self.until = deadline
+    
+    @property
+    def remaining(self):
+        return self.until - time.monotonic()
+    
+    def spend(self, seconds):
+        pass  # The job charges its own budget for the time it waited
+
+class CircuitBreaker:
+    """Opens after consecutive failures/timeouts; one trial call after the cool-down"""
+    def __init__(self, threshold, cooldown):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.lock = threading.Lock()
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = None
+        self.open_count = 0
+    
+    def allow(self):
+        with self.lock:
+            if self.state == 'open' and time.monotonic() - self.opened_at >= self.cooldown:
+                self.state = 'half_open'
+                return True
+            return self.state == 'closed'
+    
+    def record_success(self):
+        with self.lock:
+            self.state = 'closed'
+            self.failures = 0
+    
+    def abandon_trial(self):
+        """The half-open trial call never ran; let the next call try instead"""
+        with self.lock:
+            if self.state == 'half_open':
+                self.state = 'open'
+    
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.state == 'half_open' or self.failures >= self.threshold:
+                if self.state != 'open':
+                    self.open_count += 1
+                self.state = 'open'
+                self.opened_at = time.monotonic()
+    
+    def snapshot(self):
+        with self.lock:
+            return {
+                'state': self.state,
+                'consecutive_failures': self.failures,
+                'times_opened': self.open_count,
+                'cooldown_remaining': round(max(0, self.cooldown - (time.monotonic() - self.opened_at)), 1)
+                                      if self.state == 'open' else 0
+            }
 
 class GoogleAIService:
     def __init__(self):
         self.model = None
+        self.vision_model = None
+        self.breaker = CircuitBreaker(AI_BREAKER_THRESHOLD, AI_BREAKER_COOLDOWN)
+        self.latencies = deque(maxlen=200)
+        self.stats = {'calls': 0, 'successes': 0, 'hedges': 0, 'hedge_wins': 0, 'timeouts': 0,
+                      'failures': 0, 'short_circuited': 0, 'rate_limited': 0}
+        self.stats_lock = threading.Lock()
+        self.rate_limiter = RateLimiter(AI_RATE_LIMIT_RPM)
+        self.dispatcher = None
         self.initialize_model()
+        if self.model and AI_BATCHING_ENABLED:
+            self.dispatcher = AIBatchDispatcher(self.generate, AI_BATCH_WINDOW, AI_BATCH_MAX_ITEMS)
     
     def initialize_model(self):
         """Initialize Gemini model"""
         try:
+            if AI_MODEL == 'fake':
+                self.model = self.vision_model = LocalFakeModel()
+                return True
             if GOOGLE_API_KEY:
                 self.model = genai.GenerativeModel('gemini-pro')
+                self.vision_model = genai.GenerativeModel(AI_VISION_MODEL)
                 return True
             return False
         except Exception as e:
             print(f"AI Model initialization failed: {e}")
             return False
     
-    def analyze_video_content(self, video_info):
-        """Use Gemini AI to analyze video and suggest segmentation"""
+    def hedge_delay(self):
+        """p95 of recent call latencies (floor AI_HEDGE_MIN_DELAY)"""
+        with self.stats_lock:
+            latencies = sorted(self.latencies)
+        if len(latencies) < 20:
+            return AI_HEDGE_MIN_DELAY
+        return max(AI_HEDGE_MIN_DELAY, latencies[int(len(latencies) * 0.95) - 1])
+    
+    def count(self, stat, latency=None):
+        with self.stats_lock:
+            self.stats[stat] += 1
+            if latency is not None:
+                self.latencies.append(latency)
+    
+    def generate(self, prompt, budget=None, model=None):
+        """generate_content within the job's AI budget, hedged, behind the circuit breaker"""
+        token = get_cancel_token()
+        if token and token.cancelled:
+            token.count('ai_calls_skipped')
+            raise JobCancelled(token.reason)
+        if not self.breaker.allow():
+            self.count('short_circuited')
+            raise AICircuitOpenError('AI circuit open, using fallback')
+        
+        self.count('calls')
+        budget = budget or AIBudget()
+        deadline = budget.deadline()
+        started = time.monotonic()
+        sent = False
+        try:
+            if budget.remaining <= 0:
+                # Earlier calls used up the job's budget; don't start another
+                self.count('timeouts')
+                raise AITimeoutError('AI budget for this job already spent')
+            if not self.rate_limiter.acquire(timeout=max(0, deadline - started)):
+                self.count('rate_limited')
+                raise AITimeoutError('AI rate limit wait exceeded the job budget')
+            model = model or self.model
+            # A request timeout too: abandoned and hedged calls would otherwise hold
+            # ai_executor's threads for as long as a hung API keeps them
+            request_options = lambda: {'timeout': max(1.0, deadline - time.monotonic())}
+            submitted = {ai_executor.submit(run_blocking, model.generate_content, prompt,
+                                            request_options=request_options()): time.monotonic()}
+            sent = True
+            
+            # Fire a second, identical request once the first is slower than p95
+            hedge_delay = self.hedge_delay()
+            if AI_HEDGE_ENABLED and time.monotonic() + hedge_delay < deadline:
+                done, _ = wait_cancellable(submitted, timeout=hedge_delay)
+                if not done and self.rate_limiter.acquire(timeout=0):
+                    self.count('hedges')
+                    submitted[ai_executor.submit(run_blocking, model.generate_content, prompt,
+                                                 request_options=request_options())] = time.monotonic()
+            
+            pending, error = set(submitted), None
+            while pending:
+                done, pending = wait_cancellable(pending, timeout=max(0, deadline - time.monotonic()),
+                                                 return_when=FIRST_COMPLETED)
+                if not done:
+                    break
+                for future in done:
+                    if future.exception() is None:
+                        latency = time.monotonic() - submitted[future]
+                        self.breaker.record_success()
+                        hedged = future is not next(iter(submitted))
+                        self.count('hedge_wins' if hedged else 'successes', latency)
+                        metrics = get_job_metrics()
+                        if metrics:
+                            metrics.add_ai_call(latency, future.result())
+                        return future.result()
+                    error = future.exception()
+            
+            # Abandoned calls finish in the background; nothing waits on them
+            self.breaker.record_failure()
+            if pending or error is None:
+                self.count('timeouts')
+                raise AITimeoutError(f'AI call exceeded the job budget after {time.monotonic() - started:.1f}s')
+            self.count('failures')
+            raise error
+        except JobCancelled:
+            # The job is gone; the in-flight call finishes in the background
+            self.breaker.abandon_trial()
+            raise
+        finally:
+            if not sent:
+                # allow() may have made this the half-open trial: leave the trial to the next call
+                self.breaker.abandon_trial()
+            budget.spend(time.monotonic() - started)
+    
+    def get_stats(self):
+        """Breaker state and call/timeout counters"""
+        with self.stats_lock:
+            stats = dict(self.stats)
+        stats['hedge_delay'] = round(self.hedge_delay(), 2)
+        stats['breaker'] = self.breaker.snapshot()
+        if self.dispatcher:
+            stats['batching'] = self.dispatcher.get_stats()
+        return stats
+    
+    def analyze_video_content(self, video_info, budget=None, frames=None):
+        """Use Gemini AI to analyze video (and its sampled keyframes) and suggest segmentation"""
         try:
             if not self.model:
                 return self.get_fallback_analysis()
@@ -513,13 +837,28 @@ class GoogleAIService:
             }}
             """
             
-            response = self.model.generate_content(prompt)
+            if frames and self.vision_model:
+                response = self.generate(self.build_frame_prompt(prompt, frames), budget, self.vision_model)
+            else:
+                response = self.generate(prompt, budget)
             return self.parse_ai_response(response.text)
             
         except Exception as e:
             print(f"AI Analysis error: {e}")
             return self.get_fallback_analysis(video_info['segment_count'])
     
+    def build_frame_prompt(self, prompt, frames):
+        """Multimodal request: the text prompt, then each segment's keyframes under a label"""
+        contents = [prompt + "\n            The sampled keyframes of each segment follow; base the titles and "
+                             "description on what they show.\n"]
+        segment = None
+        for frame in frames:
+            if frame['segment'] != segment:
+                segment = frame['segment']
+                contents.append(f"Segment {segment + 1}:")
+            contents.append({'mime_type': 'image/jpeg', 'data': frame['jpeg']})
+        return contents
+    
     def parse_ai_response(self, response_text):
         """Parse AI response and extract JSON"""
         try:
@@ -543,30 +882,34 @@ class GoogleAIService:
             "description": "Video content ready for segmentation"
         }
     
-    def generate_segment_metadata(self, segments_info):
+    def generate_segment_metadata(self, segments_info, budget=None):
         """Generate metadata for each segment using AI"""
         try:
             if not self.model:
                 return []
             
-            prompt = f"""
-            Generate engaging titles and descriptions for {len(segments_info)} video segments.
-            Each segment is approximately 2 minutes long.
-            
-            Respond in JSON format:
-            {{
-                "segments": [
-                    {{
-                        "title": "creative title for segment 1",
-                        "description": "engaging description",
-                        "duration": "2:00"
-                    }},
-                    ...
-                ]
-            }}
-            """
+            if self.dispatcher:
+                # Batched with other jobs' requests; wait at most the job's AI budget
+                budget = budget or AIBudget()
+                started = time.monotonic()
+                # Individual fallbacks for this request get only what is left of the job's budget
+                future = self.dispatcher.submit(len(segments_info), AIDeadline(budget.deadline()))
+                try:
+                    wait_cancellable([future], timeout=max(budget.remaining, 0))
+                    segments, tokens = future.result(timeout=0)
+                finally:
+                    budget.spend(time.monotonic() - started)
+                    # Budget spent or job cancelled while still queued: drop it from the batch
+                    if future.cancel():
+                        token = get_cancel_token()
+                        if token and token.cancelled:
+                            token.count('ai_calls_skipped')
+                metrics = get_job_metrics()
+                if metrics:
+                    metrics.add_ai_call(time.monotonic() - started, tokens=tokens)
+                return segments
             
-            response = self.model.generate_content(prompt)
+            response = self.generate(build_segment_metadata_prompt(len(segments_info)), budget)
             return self.parse_segment_metadata(response.text)
             
         except Exception as e:
@@ -600,33 +943,147 @@ def get_video_duration(file_path):
             'format=duration', '-of', 
             'default=noprint_wrappers=1:nokey=1', file_path
         ]
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=30)
+        result = run_command(cmd, timeout=30)
         return float(result.stdout.strip())
-    except:
+    except Exception:
         return 0
 
-def split_video_optimized(input_path, output_dir, segment_duration=120):
-    """Optimized video splitting with ffmpeg"""
+def run_preflight(probe, *args):
+    """(info, error): error is set for a corrupt MP4/MOV, info is None when preflight can't tell"""
+    if not PREFLIGHT_ENABLED:
+        return None, None
+    try:
+        return probe(*args), None
+    except PreflightError as e:
+        return None, str(e)
+    except ClientError as e:
+        print(f"Preflight S3 error: {e}")
+        return None, None
+    except Exception as e:
+        print(f"Preflight error: {e}")
+        return None, None
+
+def has_video_stream(file_path):
+    """Check (header only) whether the file has a video stream"""
     try:
-        os.makedirs(output_dir, exist_ok=True)
-        
-        # Use fast copying without re-encoding
         cmd = [
-            'ffmpeg', '-i', input_path,
-            '-c', 'copy',  # No re-encoding for speed
-            '-map', '0',
-            '-segment_time', str(segment_duration),
-            '-f', 'segment',
-            '-reset_timestamps', '1',
-            '-y',  # Overwrite output files
-            os.path.join(output_dir, 'segment_%03d.mp4')
+            'ffprobe', '-v', 'error', '-select_streams', 'v:0',
+            '-show_entries', 'stream=codec_type', '-of', 'csv=p=0', file_path
         ]
+        result = run_command(cmd, timeout=30)
+        return 'video' in result.stdout
+    except Exception:
+        return False
+
+def split_video_optimized(input_path, output_dir, segment_duration=120, previews=None, renditions=None,
+                          hls=False, cut_points=None):
+    """Optimized video splitting with ffmpeg.
+
+    With previews on, the same invocation also decodes keyframes only
+    (-skip_frame nokey is a decoder option, so the stream-copied segments are
+    untouched) into small thumbnails - the source is read exactly once.
+
+    Optional renditions (names from RENDITION_PRESETS) are encoded from that
+    same single decode: a split filter feeds one encoder + segment muxer per
+    rendition, written to renditions/<name>/. Rendition segments are cut on
+    the same frames as the stream copy: at the preflight cut_points when
+    known, else with keyframes forced exactly where the source has them.
+
+    With hls on, an HLS package (media playlist + fMP4/TS chunks) is muxed
+    by stream copy into hls/ in the same pass.
+    """
+    try:
+        os.makedirs(output_dir, exist_ok=True)
+        if previews is None:
+            previews = PREVIEWS_ENABLED
+        renditions = renditions or []
+        has_video = has_video_stream(input_path)
+        previews = previews and has_video
+        if not has_video:
+            renditions = []
+        
+        cmd = ['ffmpeg']
+        if previews and not renditions:
+            cmd += ['-skip_frame', 'nokey']
+        
+        cmd += ['-i', input_path]
+        
+        preview_filter = f'scale={PREVIEW_THUMB_WIDTH}:-2'
+        if renditions:
+            # Every frame is decoded once and fanned out by the split filter;
+            # the preview branch keeps only keyframes
+            branches = len(renditions) + (1 if previews else 0)
+            graph = [f"[0:v:0]split={branches}" + ''.join(f'[s{i}]' for i in range(branches))]
+            for i, name in enumerate(renditions):
+                # Never upscale a smaller source
+                graph.append(f"[s{i}]scale=-2:'min({RENDITION_PRESETS[name]['height']},ih)'[r{i}]")
+            if previews:
+                graph.append(f"[s{len(renditions)}]select=key,{preview_filter}[pv]")
+            cmd += [
+                '-filter_complex', ';'.join(graph),
+                '-filter_complex_threads', str(os.cpu_count() or 1)
+            ]
+        cmd += segment_output_args(output_dir, segment_duration)
+        
+        if renditions:
+            # Share the cores between the encoders instead of each one
+            # spawning a thread per core
+            encoder_threads = max(1, (os.cpu_count() or 1) // len(renditions))
+            cuts = ','.join(f'{t:.3f}' for t in (cut_points or [])[1:])
+            if cuts:
+                rendition_cuts = ['-force_key_frames', cuts, '-segment_times', cuts]
+            else:
+                # No extra (GOP, scene-cut) keyframes the segment muxer could cut on first
+                rendition_cuts = ['-force_key_frames', 'source', '-g', '1000000', '-sc_threshold', '0',
+                                  '-segment_time', str(segment_duration)]
+            for i, name in enumerate(renditions):
+                preset = RENDITION_PRESETS[name]
+                rendition_dir = os.path.join(output_dir, 'renditions', name)
+                os.makedirs(rendition_dir, exist_ok=True)
+                cmd += [
+                    '-map', f'[r{i}]', '-map', '0:a:0?',
+                    '-c:v', 'libx264', '-preset', 'veryfast',
+                    '-b:v', preset['video_bitrate'],
+                    '-maxrate', preset['video_bitrate'],
+                    '-bufsize', preset['bufsize'],
+                    '-threads', str(encoder_threads),
+                    '-c:a', 'aac', '-b:a', preset['audio_bitrate']
+                ] + rendition_cuts + [
+                    '-f', 'segment',
+                    '-reset_timestamps', '1',
+                    os.path.join(rendition_dir, 'segment_%03d.mp4')
+                ]
+        
+        if hls:
+            cmd += hls_output_args(output_dir)
+        
+        if previews:
+            thumbs_dir = os.path.join(output_dir, 'previews', 'keyframes')
+            os.makedirs(thumbs_dir, exist_ok=True)
+            cmd += ['-map', '[pv]'] if renditions else ['-map', '0:v:0', '-vf', preview_filter]
+            # Every thumbnail is named after its own pts (in ms), so nothing
+            # depends on matching images to log lines; passthrough never drops
+            # or duplicates a frame
+            cmd += [
+                '-vsync', 'passthrough',
+                '-enc_time_base', '1/1000',
+                '-q:v', '5',
+                '-f', 'image2',
+                '-frame_pts', '1',
+                os.path.join(thumbs_dir, 'kf_%d.jpg')
+            ]
         
-        # Run with timeout
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=300)
+        # Run with timeout (re-encoding renditions takes far longer than copying)
+        timeout = RENDITION_TIMEOUT if renditions else 300
+        result = run_command(cmd, timeout=timeout)
         
         if result.returncode == 0:
             segments = [f for f in os.listdir(output_dir) if f.startswith('segment_')]
+            metrics = get_job_metrics()
+            if metrics:
+                metrics.add_io(read=os.path.getsize(input_path), written=get_directory_bytes(output_dir))
+            if previews:
+                build_segment_previews(output_dir, segment_duration)
             return True, sorted(segments)
         else:
             return False, f"FFmpeg error: {result.stderr}"
@@ -636,25 +1093,508 @@ def split_video_optimized(input_path, output_dir, segment_duration=120):
     except Exception as e:
         return False, str(e)
 
+def segment_output_args(output_dir, segment_duration):
+    """ffmpeg output options for the stream-copied segments and their CSV list"""
+    return [
+        '-c', 'copy',  # No re-encoding for speed
+        '-map', '0',
+        '-segment_time', str(segment_duration),
+        '-f', 'segment',
+        '-reset_timestamps', '1',
+        '-segment_list', os.path.join(output_dir, 'split_index.csv'),
+        '-segment_list_type', 'csv',
+        '-y',  # Overwrite output files
+        os.path.join(output_dir, 'segment_%03d.mp4')
+    ]
+
+def hls_output_args(output_dir):
+    """ffmpeg output options muxing an HLS package (stream copy) into output_dir/hls"""
+    hls_dir = os.path.join(output_dir, 'hls')
+    os.makedirs(hls_dir, exist_ok=True)
+    extension = 'm4s' if HLS_SEGMENT_TYPE == 'fmp4' else 'ts'
+    args = [
+        '-map', '0:v:0?', '-map', '0:a:0?',
+        '-c', 'copy',
+        '-f', 'hls',
+        '-hls_time', str(HLS_SEGMENT_TIME),
+        '-hls_playlist_type', 'vod',
+        '-hls_segment_type', HLS_SEGMENT_TYPE
+    ]
+    if HLS_SEGMENT_TYPE == 'fmp4':
+        args += ['-hls_fmp4_init_filename', 'init.mp4']
+    if HLS_BYTERANGE:
+        args += ['-hls_flags', 'single_file',
+                 '-hls_segment_filename', os.path.join(hls_dir, f'media.{extension}')]
+    else:
+        args += ['-hls_segment_filename', os.path.join(hls_dir, f'chunk_%05d.{extension}')]
+    return args + [os.path.join(hls_dir, 'media.m3u8')]
+
+def read_upload_chunk(stream):
+    """Next chunk of a streamed request body; a client gone mid-upload cancels the job"""
+    try:
+        return stream.read(INGEST_CHUNK_SIZE)
+    except ClientDisconnected:
+        token = get_cancel_token()
+        if token:
+            token.cancel('client disconnected')
+        raise JobCancelled('client disconnected')
+
+def read_upload_head(stream):
+    """Read the start of a streamed upload until its container is known: (head bytes, container or None)"""
+    head = b''
+    while len(head) < INGEST_SNIFF_BYTES:
+        chunk = read_upload_chunk(stream)
+        if not chunk:
+            break
+        head += chunk
+        container = sniff_streamable(head)
+        if container is not None:
+            return head, container or None
+    return head, None
+
+def save_upload(head, stream, file_path):
+    """Write the rest of a streamed upload to file_path"""
+    with open(file_path, 'wb') as f:
+        chunk = head
+        while chunk:
+            f.write(chunk)
+            chunk = read_upload_chunk(stream)
+
+def split_video_streaming(head, stream, file_path, output_dir, segment_duration=120, hls=False,
+                          on_segment=None):
+    """Split an upload while it is still arriving (containers sniff_streamable accepts).
+
+    The body is written to file_path and piped into one stream-copy segment
+    muxer at the same time. The muxer closes a segment once it reads the
+    first keyframe past its end, and only then lists it in split_index.csv,
+    so on_segment(name, start, end) is called for each segment about one
+    segment's worth of upload after it starts rather than after the whole
+    file. Returns (success, segments or error) like split_video_optimized.
+    """
+    try:
+        os.makedirs(output_dir, exist_ok=True)
+        cmd = ['ffmpeg', '-i', 'pipe:0'] + segment_output_args(output_dir, segment_duration)
+        if hls:
+            cmd += hls_output_args(output_dir)
+        
+        token = get_cancel_token()
+        published = 0
+        received = 0
+        
+        def publish():
+            nonlocal published
+            index = read_split_index(output_dir, complete_only=True)
+            for name, start, end in index[published:]:
+                if on_segment:
+                    on_segment(name, start, end)
+            published = len(index)
+        
+        with tempfile.TemporaryFile() as log, open(file_path, 'wb') as source:
+            with piped_command(cmd, stderr=log) as process:
+                chunk = head
+                try:
+                    while chunk:
+                        source.write(chunk)
+                        process.stdin.write(chunk)
+                        received += len(chunk)
+                        publish()
+                        if token:
+                            token.check()
+                        chunk = read_upload_chunk(stream)
+                    process.stdin.close()
+                except BrokenPipeError:
+                    pass  # ffmpeg gave up on the input; its exit status says why
+                
+                # The last segments are closed at the end of the input
+                while True:
+                    try:
+                        process.wait(timeout=INGEST_POLL_INTERVAL)
+                        break
+                    except subprocess.TimeoutExpired:
+                        publish()
+                publish()
+            
+            if process.returncode != 0:
+                log.seek(0)
+                return False, f"FFmpeg error: {log.read().decode(errors='replace')[-4000:]}"
+        
+        metrics = get_job_metrics()
+        if metrics:
+            metrics.add_io(read=received, written=get_directory_bytes(output_dir))
+        return True, sorted(f for f in os.listdir(output_dir) if f.startswith('segment_'))
+    
+    except Exception as e:
+        return False, str(e)
+
+def parse_renditions(value):
+    """Validate a renditions request value (list or comma-separated string)"""
+    if not value:
+        return [], None
+    if isinstance(value, str):
+        value = [v.strip() for v in value.split(',') if v.strip()]
+    if not isinstance(value, list) or not all(isinstance(v, str) for v in value):
+        return None, 'Renditions must be a list of names'
+    unknown = [v for v in value if v not in RENDITION_PRESETS]
+    if unknown:
+        return None, f"Unknown renditions: {', '.join(map(str, unknown))}. Supported: {', '.join(RENDITION_PRESETS)}"
+    return list(dict.fromkeys(value)), None
+
+def get_rendition_segments(output_dir):
+    """List the segments produced for each rendition"""
+    renditions_dir = os.path.join(output_dir, 'renditions')
+    if not os.path.isdir(renditions_dir):
+        return {}
+    return {
+        name: sorted(f'renditions/{name}/{f}' for f in os.listdir(os.path.join(renditions_dir, name))
+                     if f.startswith('segment_'))
+        for name in sorted(os.listdir(renditions_dir))
+    }
+
+def get_directory_bytes(path):
+    """Total size of all files under path"""
+    return sum(os.path.getsize(os.path.join(root, f)) for root, dirs, files in os.walk(path) for f in files)
+
+def read_split_index(output_dir, complete_only=False):
+    """Read the segment muxer's CSV list as [(filename, start, end), ...]
+
+    complete_only skips a last line ffmpeg may still be writing.
+    """
+    index = []
+    index_path = os.path.join(output_dir, 'split_index.csv')
+    if os.path.exists(index_path):
+        with open(index_path, newline='') as f:
+            lines = f.read()
+            if complete_only:
+                lines = lines[:lines.rfind('\n') + 1]
+            for row in csv.reader(lines.splitlines()):
+                if len(row) >= 3:
+                    index.append((row[0], float(row[1]), float(row[2])))
+    return index
+
+def format_vtt_time(seconds):
+    """Format seconds as a WebVTT timestamp"""
+    millis = int(round(max(seconds, 0) * 1000))
+    hours, millis = divmod(millis, 3600000)
+    minutes, millis = divmod(millis, 60000)
+    secs, millis = divmod(millis, 1000)
+    return f"{hours:02d}:{minutes:02d}:{secs:02d}.{millis:03d}"
+
+def tile_sprite(image_paths, sprite_path):
+    """Tile thumbnails SPRITE_COLUMNS wide into one JPEG; returns the tile size"""
+    images = [Image.open(path) for path in image_paths]
+    tile_w, tile_h = images[0].size
+    columns = min(SPRITE_COLUMNS, len(images))
+    rows = (len(images) + columns - 1) // columns
+    sprite = Image.new('RGB', (columns * tile_w, rows * tile_h))
+    for n, image in enumerate(images):
+        sprite.paste(image.resize((tile_w, tile_h)), ((n % columns) * tile_w, (n // columns) * tile_h))
+        image.close()
+    sprite.save(sprite_path, quality=80)
+    return tile_w, tile_h
+
+def build_segment_previews(output_dir, segment_duration=120):
+    """Tile keyframe thumbnails into a poster, sprite sheet and WebVTT per segment"""
+    try:
+        previews_dir = os.path.join(output_dir, 'previews')
+        thumbs_dir = os.path.join(previews_dir, 'keyframes')
+        
+        # kf_<pts in ms>.jpg
+        keyframes = sorted((int(f[3:-4]) / 1000, f) for f in os.listdir(thumbs_dir)
+                           if re.fullmatch(r'kf_-?\d+\.jpg', f))
+        
+        index = read_split_index(output_dir)
+        if not index:
+            count = len([f for f in os.listdir(output_dir) if f.startswith('segment_')])
+            index = [(f'segment_{i:03d}.mp4', i * segment_duration, (i + 1) * segment_duration)
+                     for i in range(count)]
+        
+        manifest = {}
+        for i, (segment_name, start, end) in enumerate(index):
+            last = i == len(index) - 1
+            frames = [(t, f) for t, f in keyframes if t >= start and (last or t < end)]
+            if not frames:
+                continue
+            if len(frames) > SPRITE_MAX_TILES:
+                step = len(frames) / SPRITE_MAX_TILES
+                frames = [frames[int(n * step)] for n in range(SPRITE_MAX_TILES)]
+            
+            base = os.path.splitext(segment_name)[0]
+            poster_name = f'{base}_poster.jpg'
+            sprite_name = f'{base}_sprite.jpg'
+            vtt_name = f'{base}_sprite.vtt'
+            shutil.copyfile(os.path.join(thumbs_dir, frames[0][1]),
+                            os.path.join(previews_dir, poster_name))
+            
+            # Decoding/encoding JPEGs is CPU work: keep it off the gevent hub
+            tile_w, tile_h = run_blocking(tile_sprite, [os.path.join(thumbs_dir, f) for _, f in frames],
+                                          os.path.join(previews_dir, sprite_name))
+            columns = min(SPRITE_COLUMNS, len(frames))
+            
+            cues = ['WEBVTT', '']
+            for n in range(len(frames)):
+                x, y = (n % columns) * tile_w, (n // columns) * tile_h
+                cue_start = frames[n][0] - start
+                cue_end = (frames[n + 1][0] if n + 1 < len(frames) else end) - start
+                cues.append(f"{format_vtt_time(cue_start)} --> {format_vtt_time(max(cue_end, cue_start))}")
+                cues.append(f"{sprite_name}#xywh={x},{y},{tile_w},{tile_h}")
+                cues.append('')
+            with open(os.path.join(previews_dir, vtt_name), 'w') as f:
+                f.write('\n'.join(cues))
+            
+            manifest[segment_name] = {
+                'poster': f'previews/{poster_name}',
+                'sprite': f'previews/{sprite_name}',
+                'vtt': f'previews/{vtt_name}',
+                'tile_size': [tile_w, tile_h],
+                'keyframes': len(frames)
+            }
+        
+        shutil.rmtree(thumbs_dir, ignore_errors=True)
+        with open(os.path.join(previews_dir, 'previews.json'), 'w') as f:
+            json.dump(manifest, f, indent=2)
+        return manifest
+    except Exception as e:
+        print(f"Preview generation error: {e}")
+        return {}
+
+def get_segment_previews(output_dir):
+    """Load the preview manifest written by split_video_optimized"""
+    try:
+        with open(os.path.join(output_dir, 'previews', 'previews.json')) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def build_chapters(output_dir, ai_analysis, segment_metadata):
+    """Chapter list (start, duration, title) for the split segments"""
+    ai_titles = (ai_analysis or {}).get('segments', [])
+    chapters = []
+    for i, (segment_name, start, end) in enumerate(read_split_index(output_dir)):
+        title = None
+        if i < len(segment_metadata or []) and isinstance(segment_metadata[i], dict):
+            title = segment_metadata[i].get('title')
+        if not title and i < len(ai_titles):
+            title = ai_titles[i]
+        chapters.append({
+            'segment': segment_name,
+            'start': start,
+            'duration': max(end - start, 0),
+            'title': str(title or f'Segment {i + 1}')
+        })
+    return chapters
+
+def get_hls_bitrates(hls_dir, lines):
+    """(peak, average) segment bit rate of a media playlist, for BANDWIDTH / AVERAGE-BANDWIDTH.
+
+    Peak is taken the way RFC 8216 defines it: the highest bit rate of any run
+    of consecutive segments lasting 0.5-1.5x the target duration.
+    """
+    target, segments, byterange = None, [], None
+    for line in lines:
+        if line.startswith('#EXT-X-TARGETDURATION:'):
+            target = float(line.split(':', 1)[1])
+        elif line.startswith('#EXTINF:'):
+            duration = float(line.split(':', 1)[1].split(',')[0])
+        elif line.startswith('#EXT-X-BYTERANGE:'):
+            byterange = int(line.split(':', 1)[1].split('@')[0])
+        elif line and not line.startswith('#'):
+            size = byterange if byterange is not None else os.path.getsize(os.path.join(hls_dir, line))
+            if duration > 0:
+                segments.append((duration, size))
+            byterange = None
+    if not segments:
+        return 1, 1
+    
+    target = target or max(duration for duration, _ in segments)
+    peak = 0
+    for i in range(len(segments)):
+        run_duration = run_bytes = 0
+        for duration, size in segments[i:]:
+            run_duration += duration
+            run_bytes += size
+            if run_duration > 1.5 * target:
+                break
+            if run_duration >= 0.5 * target:
+                peak = max(peak, run_bytes * 8 / run_duration)
+    if not peak:
+        # Every run is too short or too long (e.g. a single short clip): per segment
+        peak = max(size * 8 / duration for duration, size in segments)
+    average = sum(size for _, size in segments) * 8 / sum(duration for duration, _ in segments)
+    return max(1, round(peak)), max(1, round(average))
+
+def get_hls_codecs(hls_dir):
+    """RFC 6381 CODECS value of the HLS package's streams, or None if one of them can't be named"""
+    media_files = sorted(f for f in os.listdir(hls_dir) if not f.endswith('.m3u8'))
+    probe_file = 'init.mp4' if 'init.mp4' in media_files else next(iter(media_files), None)
+    if not probe_file:
+        return None
+    try:
+        cmd = [
+            'ffprobe', '-v', 'error', '-show_entries', 'stream=codec_name,codec_tag_string,profile,level',
+            '-of', 'json', os.path.join(hls_dir, probe_file)
+        ]
+        streams = json.loads(run_command(cmd, timeout=30).stdout).get('streams', [])
+    except Exception as e:
+        print(f"HLS codec probe error: {e}")
+        return None
+    
+    codecs = []
+    for stream in streams:
+        name, profile, level = stream.get('codec_name'), stream.get('profile'), stream.get('level', 0)
+        if name == 'h264' and profile in H264_PROFILES and level > 0:
+            profile_idc, constraints = H264_PROFILES[profile]
+            codecs.append(f'avc1.{profile_idc:02X}{constraints:02X}{level:02X}')
+        elif name == 'hevc' and profile in HEVC_PROFILES and level > 0:
+            tag = stream.get('codec_tag_string') if stream.get('codec_tag_string') in ('hvc1', 'hev1') else 'hvc1'
+            codecs.append(f'{tag}.{HEVC_PROFILES[profile]}.L{level}.B0')
+        elif name == 'aac' and profile in AAC_OBJECT_TYPES:
+            codecs.append(f'mp4a.40.{AAC_OBJECT_TYPES[profile]}')
+        elif name == 'mp3':
+            codecs.append('mp4a.40.34')
+        elif name in ('ac3', 'eac3'):
+            codecs.append({'ac3': 'ac-3', 'eac3': 'ec-3'}[name])
+        else:
+            return None  # A wrong CODECS makes players skip the stream; none lets them probe
+    return ','.join(codecs) or None
+
+def finalize_hls_playlists(output_dir, chapters):
+    """Add chapter DATERANGE tags to the media playlist and write the master playlist"""
+    try:
+        hls_dir = os.path.join(output_dir, 'hls')
+        media_path = os.path.join(hls_dir, 'media.m3u8')
+        with open(media_path) as f:
+            lines = f.read().splitlines()
+        
+        # DATERANGE needs a program date; anchor the timeline at the epoch so
+        # the playlist is deterministic for a given input
+        origin = chapters[0]['start'] if chapters else 0
+        tags = ['#EXT-X-PROGRAM-DATE-TIME:1970-01-01T00:00:00.000Z']
+        for i, chapter in enumerate(chapters):
+            start_date = (datetime(1970, 1, 1) + timedelta(seconds=chapter['start'] - origin)).strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z'
+            title = chapter['title'].replace('"', "'").replace('\n', ' ')
+            tags.append(
+                f'#EXT-X-DATERANGE:ID="chapter-{i}",CLASS="{HLS_CHAPTER_CLASS}",'
+                f'START-DATE="{start_date}",DURATION={chapter["duration"]:.3f},X-TITLE="{title}"'
+            )
+        first_media = next((n for n, line in enumerate(lines)
+                            if line.startswith(('#EXTINF', '#EXT-X-MAP', '#EXT-X-BYTERANGE'))), len(lines))
+        lines[first_media:first_media] = tags
+        with open(media_path, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        
+        peak, average = get_hls_bitrates(hls_dir, lines)
+        attributes = f'BANDWIDTH={peak},AVERAGE-BANDWIDTH={average}'
+        codecs = get_hls_codecs(hls_dir)
+        if codecs:
+            attributes += f',CODECS="{codecs}"'
+        with open(os.path.join(hls_dir, 'master.m3u8'), 'w') as f:
+            f.write('#EXTM3U\n#EXT-X-VERSION:7\n#EXT-X-INDEPENDENT-SEGMENTS\n')
+            f.write(f'#EXT-X-STREAM-INF:{attributes}\nmedia.m3u8\n')
+        with open(os.path.join(hls_dir, 'chapters.json'), 'w') as f:
+            json.dump(chapters, f, indent=2)
+        return True
+    except Exception as e:
+        print(f"HLS playlist error: {e}")
+        return False
+
+def upload_hls_to_s3(hls_dir, prefix):
+    """Upload the HLS package with immutable cache headers (keys are unique per session)"""
+    if not s3_client:
+        return False
+    
+    token = get_cancel_token()
+    
+    def upload(filename):
+        if token:
+            token.check()
+        s3_client.upload_file(
+            os.path.join(hls_dir, filename), S3_BUCKET, f"{prefix}/{filename}",
+            ExtraArgs={
+                'ContentType': HLS_CONTENT_TYPES.get(os.path.splitext(filename)[1], 'application/octet-stream'),
+                'CacheControl': 'public, max-age=31536000, immutable'
+            }
+        )
+    
+    try:
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(upload, sorted(os.listdir(hls_dir))))
+        metrics = get_job_metrics()
+        if metrics:
+            size = get_directory_bytes(hls_dir)
+            metrics.add_s3(uploaded=size)
+            metrics.add_io(read=size)
+        return True
+    except (ClientError, S3UploadFailedError) as e:
+        print(f"Error uploading HLS to S3: {e}")
+        return False
+
+def get_hls_prefix(session_id):
+    return f"results/{session_id}/hls"
+
+def get_hls_url(session_id):
+    """Playback URL for an uploaded HLS package"""
+    if HLS_PUBLIC_BASE_URL:
+        return f"{HLS_PUBLIC_BASE_URL.rstrip('/')}/{get_hls_prefix(session_id)}/master.m3u8"
+    # Private bucket: serve_hls hands out the playlists with presigned media URIs
+    return f"/hls/{session_id}/master.m3u8"
+
+def sign_playlist_uris(playlist, prefix):
+    """Point a stored playlist's media URIs (chunks, init section) at presigned S3 URLs.
+
+    Playlist URIs stay relative, so players fetch them through serve_hls too.
+    """
+    def sign(uri):
+        if uri.endswith('.m3u8') or '://' in uri:
+            return uri
+        return generate_presigned_download_url(f"{prefix}/{uri}", HLS_SIGNED_URL_EXPIRATION) or uri
+    
+    lines = []
+    for line in playlist.splitlines():
+        if line.strip() and not line.startswith('#'):
+            line = sign(line.strip())
+        elif 'URI="' in line:
+            line = re.sub(r'URI="([^"]+)"', lambda match: f'URI="{sign(match.group(1))}"', line)
+        lines.append(line)
+    return '\n'.join(lines) + '\n'
+
+def zip_compress_type(filename):
+    """Store video and JPEG entries as they are; DEFLATE the rest (JSON, WebVTT)"""
+    if os.path.splitext(filename)[1].lower() in ZIP_STORED_EXTENSIONS:
+        return zipfile.ZIP_STORED
+    return zipfile.ZIP_DEFLATED
+
+def write_zip_segments(zipf, source_dir):
+    """Add the video segments (and their previews/ sprite sheets) to the archive; returns bytes read"""
+    bytes_read = 0
+    for root, dirs, files in os.walk(source_dir):
+        for file in files:
+            if file.startswith('segment_'):
+                file_path = os.path.join(root, file)
+                arcname = os.path.relpath(file_path, source_dir)  # Keep original filename
+                zipf.write(file_path, arcname, compress_type=zip_compress_type(file))
+                bytes_read += os.path.getsize(file_path)
+    return bytes_read
+
+def write_zip_file(source_dir, zip_path, metadata):
+    with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
+        write_zip_segments(zipf, source_dir)
+        
+        # Add metadata file
+        metadata_file = "segmentation_metadata.json"
+        metadata_path = os.path.join(source_dir, metadata_file)
+        with open(metadata_path, 'w') as f:
+            json.dump(metadata, f, indent=2)
+        zipf.write(metadata_path, metadata_file)
+
 def create_zip_with_metadata(source_dir, zip_path, metadata):
     """Create ZIP file with AI-generated metadata"""
     try:
-        with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-            # Add all video segments
-            for root, dirs, files in os.walk(source_dir):
-                for file in files:
-                    if file.startswith('segment_'):
-                        file_path = os.path.join(root, file)
-                        arcname = file  # Keep original filename
-                        zipf.write(file_path, arcname)
-            
-            # Add metadata file
-            metadata_file = "segmentation_metadata.json"
-            metadata_path = os.path.join(source_dir, metadata_file)
-            with open(metadata_path, 'w') as f:
-                json.dump(metadata, f, indent=2)
-            zipf.write(metadata_path, metadata_file)
-            
+        # CRC/compression of whole videos is CPU work: keep it off the gevent hub
+        run_blocking(write_zip_file, source_dir, zip_path, metadata)
+        
+        metrics = get_job_metrics()
+        if metrics:
+            metrics.add_io(read=get_segment_bytes(source_dir), written=os.path.getsize(zip_path))
         return True
     except Exception as e:
         print(f"ZIP creation error: {e}")
@@ -699,18 +1639,63 @@ def generate_presigned_url(object_name, expiration=3600):
         print(f"Error generating presigned URL: {e}")
         return None
 
-def download_from_s3(object_name, local_path):
-    """Download file from S3"""
+class PinnedObjectSubscriber(BaseSubscriber):
+    """Hands a transfer the size and ETag from our own head_object, so every GET it
+    makes carries IfMatch=<that ETag> (412 if the object was overwritten since)"""
+    def __init__(self, head):
+        self.head = head
+    
+    def on_queued(self, future, **kwargs):
+        future.meta.provide_transfer_size(self.head['ContentLength'])
+        future.meta.provide_object_etag(self.head['ETag'])
+
+def download_from_s3(object_name, local_path, head=None):
+    """Download file from S3; with `head` (a head_object response), only the bytes that head describes"""
     if not s3_client:
         return False
     
     try:
-        s3_client.download_file(S3_BUCKET, object_name, local_path)
+        if head:
+            # Ranged GETs even for small objects: those are the requests s3transfer pins with IfMatch
+            with create_transfer_manager(s3_client, TransferConfig(multipart_threshold=1)) as manager:
+                manager.download(S3_BUCKET, object_name, local_path,
+                                 subscribers=[PinnedObjectSubscriber(head)]).result()
+        else:
+            s3_client.download_file(S3_BUCKET, object_name, local_path)
+        metrics = get_job_metrics()
+        if metrics:
+            size = os.path.getsize(local_path)
+            metrics.add_s3(downloaded=size)
+            metrics.add_io(written=size)
         return True
-    except ClientError as e:
+    except (ClientError, S3DownloadFailedError) as e:
         print(f"Error downloading from S3: {e}")
         return False
 
+def acquire_source(object_name, session_id):
+    """Local copy of an S3 source video as a SourceHandle (from the source cache when on); None on failure"""
+    if not s3_client:
+        return None
+    if source_cache:
+        try:
+            head = s3_client.head_object(Bucket=S3_BUCKET, Key=object_name)
+        except ClientError as e:
+            print(f"Error reading S3 object metadata: {e}")
+            return None
+        try:
+            # The download is pinned to the ETag the entry is keyed on: an overwrite in
+            # between fails the fill instead of caching the new bytes under the old key
+            return source_cache.acquire(object_name, head['ETag'].strip('"'),
+                                        lambda path: download_from_s3(object_name, path, head),
+                                        os.path.splitext(object_name)[1])
+        except SourceCacheBusy as e:
+            print(f"Source cache: {e}, downloading separately")
+    
+    download_path = os.path.join(app.config['UPLOAD_FOLDER'], f"{session_id}_video.mp4")
+    if not download_from_s3(object_name, download_path):
+        return None
+    return SourceHandle(download_path, 'uncached')
+
 def upload_to_s3(local_path, object_name):
     """Upload file to S3"""
     if not s3_client:
@@ -718,11 +1703,144 @@ def upload_to_s3(local_path, object_name):
     
     try:
         s3_client.upload_file(local_path, S3_BUCKET, object_name)
+        metrics = get_job_metrics()
+        if metrics:
+            size = os.path.getsize(local_path)
+            metrics.add_s3(uploaded=size)
+            metrics.add_io(read=size)
         return True
-    except ClientError as e:
+    except (ClientError, S3UploadFailedError) as e:
         print(f"Error uploading to S3: {e}")
         return False
 
+class S3MultipartWriter:
+    """Write-only stream uploaded to S3 in fixed-size parts as it is written.
+
+    At most `concurrency` parts are in flight, so memory stays bounded by
+    part_size x (concurrency + 1) whatever the size of the object.
+    """
+    def __init__(self, object_name, part_size=None, concurrency=None, content_type='application/zip'):
+        self.object_name = object_name
+        self.part_size = max(part_size or S3_PART_SIZE, 5 * 1024 * 1024)  # S3 minimum part size
+        self.concurrency = concurrency or S3_UPLOAD_CONCURRENCY
+        self.buffer = bytearray()
+        self.parts = []
+        self.slots = threading.Semaphore(self.concurrency)
+        self.executor = ThreadPoolExecutor(max_workers=self.concurrency)
+        self.bytes_written = 0
+        self.closed = False
+        self.token = get_cancel_token()
+        self.upload_id = s3_client.create_multipart_upload(
+            Bucket=S3_BUCKET, Key=object_name, ContentType=content_type
+        )['UploadId']
+    
+    def write(self, data):
+        if self.token:
+            self.token.check()
+        self.buffer += data
+        self.bytes_written += len(data)
+        while len(self.buffer) >= self.part_size:
+            self.submit_part(bytes(self.buffer[:self.part_size]))
+            del self.buffer[:self.part_size]
+        return len(data)
+    
+    def flush(self):
+        pass
+    
+    def submit_part(self, body):
+        """Queue a part upload, blocking while `concurrency` parts are in flight"""
+        for future in self.parts:
+            if future.done() and future.exception():
+                raise future.exception()
+        self.slots.acquire()
+        future = self.executor.submit(self.upload_part, len(self.parts) + 1, body)
+        future.add_done_callback(lambda f: self.slots.release())
+        self.parts.append(future)
+    
+    def upload_part(self, part_number, body):
+        if self.token:
+            self.token.check()  # Queued parts of a cancelled job are never sent
+        response = s3_client.upload_part(
+            Bucket=S3_BUCKET, Key=self.object_name, UploadId=self.upload_id,
+            PartNumber=part_number, Body=body
+        )
+        return {'PartNumber': part_number, 'ETag': response['ETag']}
+    
+    def close(self):
+        """Upload the final part and complete the multipart upload"""
+        if self.closed:
+            return
+        try:
+            if self.buffer or not self.parts:
+                self.submit_part(bytes(self.buffer))
+                self.buffer = bytearray()
+            parts = [future.result() for future in self.parts]
+            s3_client.complete_multipart_upload(
+                Bucket=S3_BUCKET, Key=self.object_name, UploadId=self.upload_id,
+                MultipartUpload={'Parts': parts}
+            )
+            self.closed = True
+        except Exception:
+            self.abort()
+            raise
+        finally:
+            self.executor.shutdown(wait=False)
+    
+    def abort(self):
+        """Drop the upload so S3 doesn't keep (and bill) the orphaned parts"""
+        if self.closed:
+            return
+        self.closed = True
+        for future in self.parts:
+            future.cancel()
+        self.executor.shutdown(wait=True)
+        try:
+            s3_client.abort_multipart_upload(Bucket=S3_BUCKET, Key=self.object_name, UploadId=self.upload_id)
+        except ClientError as e:
+            print(f"Error aborting multipart upload: {e}")
+
+def get_segment_bytes(source_dir):
+    """Total size of the files create_zip_with_metadata packs"""
+    return sum(os.path.getsize(os.path.join(root, f))
+               for root, dirs, files in os.walk(source_dir) for f in files if f.startswith('segment_'))
+
+def stream_zip_to_s3(source_dir, object_name, metadata):
+    """Build the result ZIP straight into an S3 multipart upload (no local archive)"""
+    if not s3_client:
+        return False, {}
+    
+    writer = None
+    try:
+        writer = S3MultipartWriter(object_name)
+        # Runs on the request's greenlet (the part uploads need its sockets); stored
+        # video entries leave only the CRC here, not a DEFLATE of every byte
+        with zipfile.ZipFile(writer, 'w', zipfile.ZIP_DEFLATED) as zipf:
+            bytes_read = write_zip_segments(zipf, source_dir)
+            zipf.writestr("segmentation_metadata.json", json.dumps(metadata, indent=2))
+        writer.close()
+        
+        metrics = get_job_metrics()
+        if metrics:
+            metrics.add_s3(uploaded=writer.bytes_written)
+            metrics.add_io(read=bytes_read)
+        return True, {
+            'mode': 'stream',
+            'local_bytes_read': bytes_read,
+            'local_bytes_written': 0,
+            'bytes_uploaded': writer.bytes_written,
+            'parts': len(writer.parts),
+            'max_buffer_bytes': writer.part_size * (writer.concurrency + 1)
+        }
+    except JobCancelled:
+        if writer:
+            writer.abort()
+        raise
+    except Exception as e:
+        print(f"Streaming ZIP upload error: {e}")
+        if writer:
+            writer.abort()
+        return False, {}
+
 def generate_presigned_download_url(object_name, expiration=3600):
     """Generate a presigned URL for S3 download"""
     if not s3_client:
@@ -776,6 +1894,15 @@ def generate_presigned_url_route():
     else:
         return jsonify({'error': 'Failed to generate upload URL'}), 500
 
+def is_valid_session_id(session_id):
+    """True for the UUIDs /generate_presigned_url hands out (session ids become paths under uploads/ and temp/)"""
+    if not isinstance(session_id, str) or secure_filename(session_id) != session_id:
+        return False
+    try:
+        return str(uuid.UUID(session_id)) == session_id
+    except ValueError:
+        return False
+
 @app.route('/process_video', methods=['POST'])
 def process_video():
     """Process video after S3 upload"""
@@ -788,21 +1915,182 @@ def process_video():
     
     if not object_name or not session_id:
         return jsonify({'error': 'Missing required parameters'}), 400
+    if not is_valid_session_id(session_id):
+        return jsonify({'error': 'Invalid session id'}), 400
     
+    renditions, error = parse_renditions(data.get('renditions'))
+    if error:
+        return jsonify({'error': error}), 400
+    
+    profile = JOB_PROFILING or bool(data.get('profile'))
+    output_mode = data.get('output_mode', 'zip')
+    if output_mode not in OUTPUT_MODES:
+        return jsonify({'error': f"Unsupported output mode. Supported: {', '.join(sorted(OUTPUT_MODES))}"}), 400
+    
+    # Read only the MP4/MOV header boxes from S3 before committing to a full download
+    preflight, error = run_preflight(preflight_s3_object, s3_client, S3_BUCKET, object_name, SEGMENT_DURATION)
+    if error:
+        return jsonify({'error': f'Invalid video file: {error}'}), 400
+    # Travels with the job (not in the response) so frame sampling can snap to it
+    keyframe_times = video_keyframe_times(preflight)
+    if keyframe_times:
+        keyframe_times = [round(t, 3) for t in keyframe_times]
+    if preflight:
+        preflight = summarize(preflight)
+        if not preflight['faststart']:
+            print(f"Preflight: {object_name} is not faststart (moov after mdat)")
+    
+    if job_queue:
+        # Hand off to the worker fleet; poll /jobs/<job_id> for the result
+        job_id = job_queue.enqueue('process_video', {
+            'object_name': object_name,
+            'session_id': session_id,
+            'renditions': renditions,
+            'output_mode': output_mode,
+            'profile': profile,
+            'preflight': preflight,
+            'keyframe_times': keyframe_times
+        }, max_attempts=JOB_MAX_ATTEMPTS)
+        return jsonify({
+            'job_id': job_id,
+            'state': 'queued',
+            'status_url': f'/jobs/{job_id}',
+            'preflight': preflight
+        }), 202
+    
+    # Processed inside this request: the session id doubles as the job id for DELETE /jobs/<id>
+    result, status = run_inline_job(session_id, run_processing_job, object_name, session_id, renditions,
+                                    output_mode, preflight, keyframe_times, profile=profile)
+    return jsonify(result), status
+
+def run_with_accounting(job, *args, profile=False, token=None):
+    """Run a job function with per-job accounting (and cancellation) attached to its result"""
+    metrics = JobMetrics(profile=profile)
+    token = token or CancelToken()
+    with metrics.active(), token.active():
+        try:
+            result, status = job(*args)
+            if status >= 400:
+                token.check()  # Failed because it was cancelled under a fallback
+        except JobCancelled:
+            token.run_cleanups()
+            metrics.cancellation = token.report()
+            result, status = {'error': 'Job cancelled', 'cancelled': True, 'reason': token.reason}, 409
+    result['accounting'] = metrics.report()
+    return result, status
+
+def run_inline_job(job_id, job, *args, profile=False):
+    """run_with_accounting for a job processed inside the request, cancelled by
+    DELETE /jobs/<job_id> or when the client disconnects"""
+    token = CancelToken()
+    stop = threading.Event()
+    register_job(job_id, token)
+    # Lets DELETE in another web worker process tell a running job from a finished one
+    running_path = get_running_marker_path(job_id)
+    open(running_path, 'w').close()
+    watcher = threading.Thread(target=watch_inline_job, args=(job_id, token, get_client_socket(), stop),
+                               daemon=True)
+    watcher.start()
     try:
-        # Download video from S3
-        download_path = os.path.join(app.config['UPLOAD_FOLDER'], f"{session_id}_video.mp4")
-        if not download_from_s3(object_name, download_path):
-            return jsonify({'error': 'Failed to download video from storage'}), 500
+        return run_with_accounting(job, *args, profile=profile, token=token)
+    finally:
+        stop.set()
+        unregister_job(job_id)
+        for path in [running_path, get_cancel_flag_path(job_id)]:
+            if os.path.exists(path):
+                os.remove(path)
+
+def get_client_socket():
+    """The request's client socket (gunicorn or the dev server), or None"""
+    return request.environ.get('gunicorn.socket') or request.environ.get('werkzeug.socket')
+
+def client_disconnected(sock):
+    """The client closed the connection (the request body has been read, so EOF means gone)"""
+    try:
+        readable, _, _ = select.select([sock], [], [], 0)
+        return bool(readable) and sock.recv(1, socket.MSG_PEEK) == b''
+    except ConnectionError:
+        return True
+    except (OSError, ValueError):
+        return False
+
+def get_cancel_flag_path(job_id):
+    """Cancel request for an inline job running in another web worker process"""
+    return os.path.join(app.config['TEMP_FOLDER'], f'.cancel-{job_id}')
+
+def get_running_marker_path(job_id):
+    """Exists while an inline job runs, in whichever web worker process"""
+    return os.path.join(app.config['TEMP_FOLDER'], f'.running-{job_id}')
+
+def watch_inline_job(job_id, token, sock, stop):
+    while not stop.wait(CANCEL_POLL_INTERVAL):
+        try:
+            os.utime(get_running_marker_path(job_id))  # Keeps cleanup_old_files off it; a crash leaves it to age out
+        except FileNotFoundError:
+            pass
+        if sock is not None and client_disconnected(sock):
+            print(f"Client disconnected, cancelling job {job_id}")
+            token.cancel('client disconnected')
+            return
+        flag_path = get_cancel_flag_path(job_id)
+        if os.path.exists(flag_path):
+            os.remove(flag_path)
+            token.cancel('cancelled via API')
+            return
+
+def track_job_artifacts(session_id):
+    """Remove the job's partial files if it gets cancelled"""
+    token = get_cancel_token()
+    if token:
+        token.cleanups.append(lambda: remove_job_artifacts(session_id))
+
+def remove_job_artifacts(session_id):
+    """Delete a job's files in uploads/ and temp/"""
+    for path in [
+        os.path.join(app.config['UPLOAD_FOLDER'], f"{session_id}_video.mp4"),
+        os.path.join(app.config['UPLOAD_FOLDER'], session_id),
+        os.path.join(app.config['TEMP_FOLDER'], session_id),
+        os.path.join(app.config['TEMP_FOLDER'], f'segmented_videos_{session_id}.zip')
+    ]:
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+        elif os.path.exists(path):
+            os.remove(path)
+
+def run_processing_job(object_name, session_id, renditions=None, output_mode='zip', preflight=None,
+                       keyframe_times=None):
+    """Download from S3, split, analyze and publish; returns (response dict, HTTP status)
+
+    keyframe_times: the video track's keyframe table from the preflight (summarize() drops it).
+    """
+    track_job_artifacts(session_id)
+    source = None
+    try:
+        # Download video from S3 (or reuse this node's cached copy)
+        begin_stage('download')
+        source = acquire_source(object_name, session_id)
+        if not source:
+            return {'error': 'Failed to download video from storage'}, 500
+        download_path = source.path
         
-        # Get video duration
-        duration = get_video_duration(download_path)
+        # Get video duration (from the preflight header when there was one)
+        begin_stage('probe')
+        duration = (preflight or {}).get('duration') or get_video_duration(download_path)
         if duration == 0:
-            return jsonify({'error': 'Could not process video file'}), 400
+            return {'error': 'Could not process video file'}, 400
+        token = get_cancel_token()
+        if token:
+            token.media_duration = duration
         
         # Calculate segments
-        segment_duration = 120  # 2 minutes
+        segment_duration = SEGMENT_DURATION
         segment_count = max(1, int(duration / segment_duration) + (1 if duration % segment_duration > 0 else 0))
+        segments_dir = os.path.join(app.config['TEMP_FOLDER'], session_id)
+        
+        # Sample a few keyframes for the multimodal analysis
+        begin_stage('sample_frames')
+        frames, frame_sampling = sample_keyframes(download_path, duration, os.path.join(segments_dir, 'frames'),
+                                                  segment_duration, keyframe_times)
         
         # Get AI analysis
         video_info = {
@@ -811,17 +2099,22 @@ def process_video():
             'file_size_mb': round(os.path.getsize(download_path) / (1024 * 1024), 2)
         }
         
-        ai_analysis = ai_service.analyze_video_content(video_info)
+        begin_stage('ai_analysis')
+        ai_budget = AIBudget()
+        ai_analysis = ai_service.analyze_video_content(video_info, ai_budget, frames)
         
         # Split video
-        segments_dir = os.path.join(app.config['TEMP_FOLDER'], session_id)
-        success, segments = split_video_optimized(download_path, segments_dir, segment_duration)
+        begin_stage('split')
+        success, segments = split_video_optimized(download_path, segments_dir, segment_duration,
+                                                   renditions=renditions, hls=output_mode == 'hls',
+                                                   cut_points=(preflight or {}).get('cut_points'))
         
         if not success:
-            return jsonify({'error': f'Video processing failed: {segments}'}), 400
+            return {'error': f'Video processing failed: {segments}'}, 400
         
         # Generate segment metadata
-        segment_metadata = ai_service.generate_segment_metadata(segments)
+        begin_stage('ai_metadata')
+        segment_metadata = ai_service.generate_segment_metadata(segments, ai_budget)
         
         # Prepare final metadata
         final_metadata = {
@@ -830,40 +2123,87 @@ def process_video():
             'segment_count': len(segments),
             'ai_analysis': ai_analysis,
             'segments_metadata': segment_metadata,
+            'previews': get_segment_previews(segments_dir),
+            'renditions': get_rendition_segments(segments_dir),
+            'preflight': preflight,
+            'frame_sampling': dict(frame_sampling, frames=describe_frames(frames)),
             'processing_time': datetime.now().isoformat(),
             'ai_generated': bool(GOOGLE_API_KEY)
         }
+        metrics = get_job_metrics()
+        if ACCOUNTING_IN_METADATA and metrics:
+            final_metadata['accounting'] = metrics.report()  # Up to this point
+        
+        begin_stage('package')
+        if output_mode == 'hls':
+            # Stream from S3/CDN instead of downloading an archive
+            chapters = build_chapters(segments_dir, ai_analysis, segment_metadata)
+            if not finalize_hls_playlists(segments_dir, chapters):
+                return {'error': 'Failed to create HLS package'}, 500
+            if not upload_hls_to_s3(os.path.join(segments_dir, 'hls'), get_hls_prefix(session_id)):
+                return {'error': 'Failed to upload result to storage'}, 500
+            
+            return {
+                'success': True,
+                'session_id': session_id,
+                'output_mode': 'hls',
+                'hls_url': get_hls_url(session_id),
+                'chapters': chapters,
+                'segment_count': len(segments),
+                'total_duration': f"{duration:.2f} Minutes",
+                'ai_analysis': ai_analysis,
+                'ai_enabled': bool(GOOGLE_API_KEY),
+                'file_size': video_info['file_size_mb'],
+                'source_cache': source.status
+            }, 200
         
         # Create ZIP with metadata
         zip_filename = f'segmented_videos_{session_id}.zip'
-        zip_path = os.path.join(app.config['TEMP_FOLDER'], zip_filename)
+        zip_object_name = f"results/{session_id}/{zip_filename}"
         
-        if create_zip_with_metadata(segments_dir, zip_path, final_metadata):
-            # Upload ZIP to S3
-            zip_object_name = f"results/{session_id}/{zip_filename}"
-            if upload_to_s3(zip_path, zip_object_name):
-                # Generate download URL
-                download_url = generate_presigned_download_url(zip_object_name)
-                
-                return jsonify({
-                    'success': True,
-                    'session_id': session_id,
-                    'zip_filename': zip_filename,
-                    'download_url': download_url,
-                    'segment_count': len(segments),
-                    'total_duration': f"{duration:.2f} Minutes",
-                    'ai_analysis': ai_analysis,
-                    'ai_enabled': bool(GOOGLE_API_KEY),
-                    'file_size': video_info['file_size_mb']
-                })
-            else:
-                return jsonify({'error': 'Failed to upload result to storage'}), 500
+        if S3_STREAM_PACKAGING:
+            # ZIP entries go straight into a multipart upload; no local archive
+            success, packaging = stream_zip_to_s3(segments_dir, zip_object_name, final_metadata)
+            if not success:
+                return {'error': 'Failed to upload result to storage'}, 500
         else:
-            return jsonify({'error': 'Failed to create download package'}), 500
+            zip_path = os.path.join(app.config['TEMP_FOLDER'], zip_filename)
+            if not create_zip_with_metadata(segments_dir, zip_path, final_metadata):
+                return {'error': 'Failed to create download package'}, 500
+            # Upload ZIP to S3
+            if not upload_to_s3(zip_path, zip_object_name):
+                return {'error': 'Failed to upload result to storage'}, 500
+            zip_size = os.path.getsize(zip_path)
+            packaging = {
+                'mode': 'local_zip',
+                'local_bytes_read': get_segment_bytes(segments_dir) + zip_size,
+                'local_bytes_written': zip_size,
+                'bytes_uploaded': zip_size
+            }
+        
+        # Generate download URL
+        download_url = generate_presigned_download_url(zip_object_name)
+        
+        return {
+            'success': True,
+            'session_id': session_id,
+            'zip_filename': zip_filename,
+            'download_url': download_url,
+            'segment_count': len(segments),
+            'total_duration': f"{duration:.2f} Minutes",
+            'ai_analysis': ai_analysis,
+            'ai_enabled': bool(GOOGLE_API_KEY),
+            'file_size': video_info['file_size_mb'],
+            'packaging': packaging,
+            'source_cache': source.status
+        }, 200
         
     except Exception as e:
         print(f"Processing error: {e}")
-        return jsonify({'error': f'Processing error: {str(e)}'}), 500
+        return {'error': f'Processing error: {str(e)}'}, 500
+    finally:
+        if source:
+            source.release()
 
 @app.route('/upload', methods=['POST'])
 def upload_video():
@@ -885,7 +2225,16 @@ def upload_video_local():
         return jsonify({'error': 'No file selected'}), 400
     
     if not allowed_file(file.filename):
-        return jsonify({'error': 'File type not allowed. Supported: MP4, AVI, MOV, MKV, WMV, FLV, WebM, M4V'}), 400
+        return jsonify({'error': 'File type not allowed. Supported: MP4, AVI, MOV, MKV, WMV, FLV, WebM, M4V, TS'}), 400
+    
+    renditions, error = parse_renditions(request.form.get('renditions'))
+    if error:
+        return jsonify({'error': error}), 400
+    
+    profile = JOB_PROFILING or request.form.get('profile') == 'true'
+    output_mode = request.form.get('output_mode', 'zip')
+    if output_mode not in OUTPUT_MODES:
+        return jsonify({'error': f"Unsupported output mode. Supported: {', '.join(sorted(OUTPUT_MODES))}"}), 400
     
     # Generate session ID
     session_id = str(uuid.uuid4())
@@ -897,15 +2246,41 @@ def upload_video_local():
     file_path = os.path.join(upload_path, filename)
     file.save(file_path)
     
+    result, status = run_inline_job(session_id, run_local_job, file_path, filename, session_id, renditions,
+                                    output_mode, profile=profile)
+    return jsonify(result), status
+
+def run_local_job(file_path, filename, session_id, renditions=None, output_mode='zip', presplit=None):
+    """Split, analyze and package an uploaded file; returns (response dict, HTTP status)
+
+    presplit: segments already cut while the upload was streamed in (skips the split).
+    """
+    track_job_artifacts(session_id)
     try:
-        # Get video duration
-        duration = get_video_duration(file_path)
+        # Get video duration; MP4/MOV headers are parsed directly, others go to ffprobe
+        begin_stage('probe')
+        preflight, error = run_preflight(preflight_file, file_path, SEGMENT_DURATION)
+        if error:
+            return {'error': f'Invalid video file: {error}'}, 400
+        keyframe_times = video_keyframe_times(preflight)
+        if preflight:
+            preflight = summarize(preflight)
+        duration = (preflight or {}).get('duration') or get_video_duration(file_path)
         if duration == 0:
-            return jsonify({'error': 'Could not process video file. Please try another format.'}), 400
+            return {'error': 'Could not process video file. Please try another format.'}, 400
+        token = get_cancel_token()
+        if token:
+            token.media_duration = duration
         
         # Calculate segments
-        segment_duration = 120  # 2 minutes
+        segment_duration = SEGMENT_DURATION
         segment_count = max(1, int(duration / segment_duration) + (1 if duration % segment_duration > 0 else 0))
+        segments_dir = os.path.join(app.config['TEMP_FOLDER'], session_id)
+        
+        # Sample a few keyframes for the multimodal analysis
+        begin_stage('sample_frames')
+        frames, frame_sampling = sample_keyframes(file_path, duration, os.path.join(segments_dir, 'frames'),
+                                                  segment_duration, keyframe_times)
         
         # Get AI analysis
         video_info = {
@@ -914,17 +2289,25 @@ def upload_video_local():
             'file_size_mb': round(os.path.getsize(file_path) / (1024 * 1024), 2)
         }
         
-        ai_analysis = ai_service.analyze_video_content(video_info)
+        begin_stage('ai_analysis')
+        ai_budget = AIBudget()
+        ai_analysis = ai_service.analyze_video_content(video_info, ai_budget, frames)
         
         # Split video
-        segments_dir = os.path.join(app.config['TEMP_FOLDER'], session_id)
-        success, segments = split_video_optimized(file_path, segments_dir, segment_duration)
+        begin_stage('split')
+        if presplit is not None:
+            success, segments = True, presplit
+        else:
+            success, segments = split_video_optimized(file_path, segments_dir, segment_duration,
+                                                       renditions=renditions, hls=output_mode == 'hls',
+                                                       cut_points=(preflight or {}).get('cut_points'))
         
         if not success:
-            return jsonify({'error': f'Video processing failed: {segments}'}), 400
+            return {'error': f'Video processing failed: {segments}'}, 400
         
         # Generate segment metadata
-        segment_metadata = ai_service.generate_segment_metadata(segments)
+        begin_stage('ai_metadata')
+        segment_metadata = ai_service.generate_segment_metadata(segments, ai_budget)
         
         # Prepare final metadata
         final_metadata = {
@@ -933,16 +2316,42 @@ def upload_video_local():
             'segment_count': len(segments),
             'ai_analysis': ai_analysis,
             'segments_metadata': segment_metadata,
+            'previews': get_segment_previews(segments_dir),
+            'renditions': get_rendition_segments(segments_dir),
+            'preflight': preflight,
+            'frame_sampling': dict(frame_sampling, frames=describe_frames(frames)),
             'processing_time': datetime.now().isoformat(),
             'ai_generated': bool(GOOGLE_API_KEY)
         }
+        metrics = get_job_metrics()
+        if ACCOUNTING_IN_METADATA and metrics:
+            final_metadata['accounting'] = metrics.report()  # Up to this point
+        
+        begin_stage('package')
+        if output_mode == 'hls':
+            chapters = build_chapters(segments_dir, ai_analysis, segment_metadata)
+            if not finalize_hls_playlists(segments_dir, chapters):
+                return {'error': 'Failed to create HLS package'}, 500
+            
+            return {
+                'success': True,
+                'session_id': session_id,
+                'output_mode': 'hls',
+                'hls_url': f"/hls/{session_id}/master.m3u8",
+                'chapters': chapters,
+                'segment_count': len(segments),
+                'total_duration': f"{duration:.2f} Minutes",
+                'ai_analysis': ai_analysis,
+                'ai_enabled': bool(GOOGLE_API_KEY),
+                'file_size': video_info['file_size_mb']
+            }, 200
         
         # Create ZIP with metadata
         zip_filename = f'segmented_videos_{session_id}.zip'
         zip_path = os.path.join(app.config['TEMP_FOLDER'], zip_filename)
         
         if create_zip_with_metadata(segments_dir, zip_path, final_metadata):
-            return jsonify({
+            return {
                 'success': True,
                 'session_id': session_id,
                 'zip_filename': zip_filename,
@@ -951,27 +2360,263 @@ def upload_video_local():
                 'ai_analysis': ai_analysis,
                 'ai_enabled': bool(GOOGLE_API_KEY),
                 'file_size': video_info['file_size_mb']
-            })
+            }, 200
         else:
-            return jsonify({'error': 'Failed to create download package'}), 500
+            return {'error': 'Failed to create download package'}, 500
         
     except Exception as e:
         print(f"Upload error: {e}")
-        return jsonify({'error': f'Processing error: {str(e)}'}), 500
+        return {'error': f'Processing error: {str(e)}'}, 500
+
+@app.route('/ingest', methods=['POST'])
+def start_ingest():
+    """Open a streaming upload: PUT the file body to upload_url and poll status_url,
+    where segments are listed as soon as they are cut"""
+    data = request.get_json(silent=True) or {}
+    filename = data.get('filename') or ''
+    if not allowed_file(filename):
+        return jsonify({'error': 'File type not allowed. Supported: MP4, AVI, MOV, MKV, WMV, FLV, WebM, M4V, TS'}), 400
+    output_mode = data.get('output_mode', 'zip')
+    if output_mode not in OUTPUT_MODES:
+        return jsonify({'error': f"Unsupported output mode. Supported: {', '.join(sorted(OUTPUT_MODES))}"}), 400
+    
+    session_id = str(uuid.uuid4())
+    os.makedirs(os.path.join(app.config['TEMP_FOLDER'], session_id), exist_ok=True)
+    update_ingest_state(session_id, state='waiting', filename=secure_filename(filename),
+                        output_mode=output_mode, segments=[])
+    return jsonify({
+        'session_id': session_id,
+        'upload_url': f'/ingest/{session_id}/data',
+        'status_url': f'/ingest/{session_id}'
+    })
+
+@app.route('/ingest/<session_id>/data', methods=['PUT', 'POST'])
+def ingest_data(session_id):
+    """Receive the upload body (plain or chunked transfer encoding) and process it as it arrives"""
+    state = read_ingest_state(session_id)
+    if not state:
+        return jsonify({'error': 'Upload not found'}), 404
+    if not claim_ingest(session_id):
+        return jsonify({'error': 'Upload already received'}), 409
+    
+    request.max_content_length = INGEST_MAX_BYTES
+    upload_path = os.path.join(app.config['UPLOAD_FOLDER'], session_id)
+    os.makedirs(upload_path, exist_ok=True)
+    file_path = os.path.join(upload_path, state['filename'])
+    
+    profile = JOB_PROFILING or request.args.get('profile') == 'true'
+    result, status = run_inline_job(session_id, run_streaming_job, request.stream, file_path, state['filename'],
+                                    session_id, state['output_mode'], profile=profile)
+    return jsonify(result), status
+
+@app.route('/ingest/<session_id>')
+def ingest_status(session_id):
+    """Progress of a streaming upload and the segments ready so far"""
+    state = read_ingest_state(session_id)
+    if not state:
+        return jsonify({'error': 'Upload not found'}), 404
+    return jsonify(dict(state, session_id=session_id))
+
+@app.route('/ingest/<session_id>/segments/<filename>')
+def ingest_segment(session_id, filename):
+    """Download one segment as soon as it is listed (complete)"""
+    state = read_ingest_state(session_id)
+    if not state or filename not in {segment['name'] for segment in state['segments']}:
+        return jsonify({'error': 'Segment not found'}), 404
+    segments_dir = os.path.abspath(os.path.join(app.config['TEMP_FOLDER'], session_id))
+    return send_from_directory(segments_dir, filename, mimetype='video/mp4', conditional=True)
+
+def get_ingest_state_path(session_id):
+    return os.path.join(app.config['TEMP_FOLDER'], session_id, 'ingest.json')
+
+def read_ingest_state(session_id):
+    """State of a streaming upload (a file, so every web worker sees it), or None"""
+    if secure_filename(session_id) != session_id:
+        return None
+    try:
+        with open(get_ingest_state_path(session_id)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def update_ingest_state(session_id, **changes):
+    """Merge changes into the upload's state file; replaced atomically so readers never see half of it"""
+    path = get_ingest_state_path(session_id)
+    state = read_ingest_state(session_id) or {}
+    state.update(changes, updated_at=datetime.now().isoformat())
+    temp_path = f'{path}.{uuid.uuid4().hex[:8]}.tmp'
+    with open(temp_path, 'w') as f:
+        json.dump(state, f)
+    os.replace(temp_path, path)
+
+def claim_ingest(session_id):
+    """Only the first request for an upload URL gets to send the body"""
+    try:
+        os.close(os.open(get_ingest_state_path(session_id) + '.claimed', os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        return True
+    except FileExistsError:
+        return False
+
+def run_streaming_job(stream, file_path, filename, session_id, output_mode='zip'):
+    """Receive a streamed upload, splitting it as it arrives when the container allows,
+    then analyze and package it like run_local_job; returns (response dict, HTTP status)"""
+    track_job_artifacts(session_id)
+    try:
+        begin_stage('ingest')
+        started = time.monotonic()
+        segments_dir = os.path.join(app.config['TEMP_FOLDER'], session_id)
+        head, container = read_upload_head(stream)
+        ingest = {'container': container, 'streamed': container is not None, 'first_segment_s': None}
+        update_ingest_state(session_id, state='receiving', container=container)
+        
+        if container:
+            ready = []
+            
+            def on_segment(name, start, end):
+                if not ready:
+                    ingest['first_segment_s'] = round(time.monotonic() - started, 3)
+                ready.append({'name': name, 'start': start, 'end': end,
+                              'url': f'/ingest/{session_id}/segments/{name}'})
+                update_ingest_state(session_id, segments=ready, first_segment_s=ingest['first_segment_s'])
+            
+            success, segments = split_video_streaming(head, stream, file_path, segments_dir, SEGMENT_DURATION,
+                                                      hls=output_mode == 'hls', on_segment=on_segment)
+            if not success:
+                update_ingest_state(session_id, state='failed', error=segments)
+                return {'error': f'Video processing failed: {segments}'}, 400
+        else:
+            # Regular MP4/MOV, AVI...: nothing can be cut before the whole file is here
+            save_upload(head, stream, file_path)
+            segments = None
+        ingest['upload_s'] = round(time.monotonic() - started, 3)
+        update_ingest_state(session_id, state='processing', upload_s=ingest['upload_s'])
+        
+        result, status = run_local_job(file_path, filename, session_id, output_mode=output_mode,
+                                       presplit=segments)
+        if status == 200:
+            result['ingest'] = ingest
+            update_ingest_state(session_id, state='done', zip_filename=result.get('zip_filename'),
+                                hls_url=result.get('hls_url'))
+        else:
+            update_ingest_state(session_id, state='failed', error=result.get('error'))
+        return result, status
+    
+    except Exception as e:
+        print(f"Ingest error: {e}")
+        return {'error': f'Processing error: {str(e)}'}, 500
 
 @app.route('/download/<filename>')
 def download_file(filename):
-    """Download the segmented videos ZIP"""
+    """Download the segmented videos ZIP.
+
+    Supports Range / If-Range and conditional GET against a stable ETag so
+    interrupted downloads resume. With DOWNLOAD_OFFLOAD set, the worker only
+    authorizes the request and the front proxy serves the bytes.
+    """
     try:
-        file_path = os.path.join(app.config['TEMP_FOLDER'], filename)
-        if os.path.exists(file_path):
-            download_name = f"ai_segmented_videos_{datetime.now().strftime('%Y%m%d_%H%M')}.zip"
-            return send_file(file_path, as_attachment=True, download_name=download_name)
+        filename = secure_filename(filename)
+        file_path = os.path.abspath(os.path.join(app.config['TEMP_FOLDER'], filename))
+        if os.path.isfile(file_path):
+            stat = os.stat(file_path)
+            # Same file -> same validators on every worker and after restarts
+            etag = hashlib.sha1(f"{filename}-{stat.st_size}-{stat.st_mtime_ns}".encode()).hexdigest()
+            download_name = f"ai_segmented_videos_{datetime.fromtimestamp(stat.st_mtime).strftime('%Y%m%d_%H%M')}.zip"
+            
+            if DOWNLOAD_OFFLOAD == 'nginx':
+                # nginx serves the internal location (alias of TEMP_FOLDER) with
+                # sendfile, ranges and conditionals; we return immediately
+                response = app.response_class(mimetype='application/zip')
+                response.headers['X-Accel-Redirect'] = f"{DOWNLOAD_ACCEL_PREFIX.rstrip('/')}/{filename}"
+                response.headers['Content-Disposition'] = f'attachment; filename="{download_name}"'
+                response.headers['Cache-Control'] = 'private, max-age=3600'
+                return response
+            
+            response = send_file(file_path, as_attachment=True, download_name=download_name,
+                                 conditional=True, etag=etag, last_modified=stat.st_mtime, max_age=3600)
+            response.cache_control.public = False
+            response.cache_control.private = True
+            return response
         else:
             return jsonify({'error': 'File not found or expired'}), 404
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/hls/<session_id>/<path:filename>')
+def serve_hls(session_id, filename):
+    """Serve an HLS package: generated locally, or uploaded to a private bucket"""
+    hls_dir = os.path.join(app.config['TEMP_FOLDER'], secure_filename(session_id), 'hls')
+    if not os.path.isfile(os.path.join(hls_dir, filename)) and s3_client and not HLS_PUBLIC_BASE_URL:
+        return serve_s3_hls(session_id, filename)
+    response = send_from_directory(os.path.abspath(hls_dir), filename,
+                                   mimetype=HLS_CONTENT_TYPES.get(os.path.splitext(filename)[1]))
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
+
+def serve_s3_hls(session_id, filename):
+    """Playlists of an S3 package with presigned media URIs; anything else redirects to S3"""
+    if secure_filename(session_id) != session_id or '..' in filename.split('/'):
+        return jsonify({'error': 'File not found'}), 404
+    key = f"{get_hls_prefix(session_id)}/{filename}"
+    if not filename.endswith('.m3u8'):
+        url = generate_presigned_download_url(key, HLS_SIGNED_URL_EXPIRATION)
+        return redirect(url) if url else (jsonify({'error': 'File not found'}), 404)
+    try:
+        playlist = s3_client.get_object(Bucket=S3_BUCKET, Key=key)['Body'].read().decode()
+    except ClientError:
+        return jsonify({'error': 'File not found'}), 404
+    response = app.response_class(sign_playlist_uris(playlist, get_hls_prefix(session_id)),
+                                  mimetype=HLS_CONTENT_TYPES['.m3u8'])
+    # Well inside the signatures' lifetime
+    response.headers['Cache-Control'] = 'private, max-age=300'
+    return response
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    """Status (and result, once done) of a queued processing job"""
+    if not job_queue:
+        return jsonify({'error': 'Job queue not configured'}), 404
+    
+    job = job_queue.get(job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    
+    return jsonify({
+        'job_id': job['id'],
+        'state': job['state'],
+        'attempts': job['attempts'],
+        'result': job['result'],
+        'error': job['error']
+    })
+
+@app.route('/jobs/<job_id>', methods=['DELETE'])
+def cancel_job_route(job_id):
+    """Cancel a queued or running processing job"""
+    if cancel_job(job_id, 'cancelled via API'):
+        return jsonify({'job_id': job_id, 'state': 'cancelling'}), 202
+    
+    if job_queue:
+        state = job_queue.cancel(job_id)
+        if state == 'leased':
+            return jsonify({'job_id': job_id, 'state': 'cancelling'}), 202
+        if state == 'cancelled':
+            return jsonify({'job_id': job_id, 'state': 'cancelled'})
+        if state:
+            return jsonify({'error': f'Job already {state}'}), 409
+    
+    if secure_filename(job_id) != job_id:
+        return jsonify({'error': 'Job not found'}), 404
+    # Inline job handled by another web worker process: its watcher picks up the flag
+    if os.path.exists(get_running_marker_path(job_id)):
+        open(get_cancel_flag_path(job_id), 'w').close()
+        return jsonify({'job_id': job_id, 'state': 'cancelling'}), 202
+    finished = [
+        os.path.join(app.config['TEMP_FOLDER'], job_id),
+        os.path.join(app.config['TEMP_FOLDER'], f'segmented_videos_{job_id}.zip')
+    ]
+    if any(os.path.exists(path) for path in finished):
+        return jsonify({'error': 'Job is not running'}), 409
+    return jsonify({'error': 'Job not found'}), 404
+
 @app.route('/api/status')
 def api_status():
     """API status endpoint"""
@@ -979,6 +2624,9 @@ def api_status():
         'status': 'operational',
         'ai_enabled': bool(GOOGLE_API_KEY),
         's3_enabled': bool(s3_client),
+        'job_queue': JOB_QUEUE_BACKEND or None,
+        'ai': ai_service.get_stats(),
+        'source_cache': source_cache.get_stats() if source_cache else None,
         'timestamp': datetime.now().isoformat()
     })
 
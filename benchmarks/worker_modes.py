@@ -0,0 +1,91 @@
+"""Compare gunicorn sync vs gevent workers on long-running requests.
+
+Each request blocks the way a processing job does: an ffmpeg-like child
+process wait plus a blocking call offloaded with run_blocking (Gemini).
+Run from the repo root:
+
+    python benchmarks/worker_modes.py --requests 200 --job-seconds 2
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import Flask, jsonify
+
+bench_app = Flask(__name__)
+
+
+def run_blocking(func, *args, **kwargs):
+    # Same helper as app.run_blocking, kept local so the benchmark doesn't
+    # need the AI / S3 configuration app.py loads at import
+    if 'gevent' in sys.modules:
+        from gevent import monkey, get_hub
+        if monkey.is_module_patched('socket'):
+            return get_hub().threadpool.apply(func, args, kwargs)
+    return func(*args, **kwargs)
+
+
+@bench_app.route('/job/<float:seconds>')
+def job(seconds):
+    subprocess.run(['sleep', str(seconds / 2)], capture_output=True)
+    run_blocking(time.sleep, seconds / 2)
+    return jsonify({'ok': True})
+
+
+def fetch(url):
+    start = time.time()
+    try:
+        with urllib.request.urlopen(url, timeout=600) as response:
+            response.read()
+        return time.time() - start, True
+    except Exception:
+        return time.time() - start, False
+
+
+def run_mode(mode, args):
+    env = dict(os.environ, WORKER_MODE=mode, PORT=str(args.port), WEB_CONCURRENCY=str(args.workers),
+               GUNICORN_TIMEOUT='600')
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'benchmarks.worker_modes:bench_app'],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        base = f'http://127.0.0.1:{args.port}'
+        for _ in range(100):
+            if fetch(f'{base}/job/0.0')[1]:
+                break
+            time.sleep(0.1)
+        
+        start = time.time()
+        with ThreadPoolExecutor(max_workers=args.requests) as executor:
+            results = list(executor.map(fetch, [f'{base}/job/{args.job_seconds}'] * args.requests))
+        elapsed = time.time() - start
+    finally:
+        server.terminate()
+        server.wait()
+    
+    latencies = sorted(latency for latency, ok in results if ok)
+    failed = len(results) - len(latencies)
+    p = lambda q: latencies[min(len(latencies) - 1, int(q * len(latencies)))] if latencies else 0
+    print(f"{mode:>6}: {args.requests} jobs x {args.job_seconds}s on {args.workers} workers -> "
+          f"wall {elapsed:.1f}s, p50 {p(0.5):.1f}s, p99 {p(0.99):.1f}s, failed {failed}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--job-seconds', type=float, default=2.0)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--modes', default='sync,gevent')
+    args = parser.parse_args()
+    for mode in args.modes.split(','):
+        run_mode(mode, args)
+
+
+if __name__ == '__main__':
+    main()
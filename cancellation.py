@@ -0,0 +1,184 @@
+"""Job cancellation.
+
+A CancelToken is made active for the thread running a job, like its
+JobMetrics. Cancelling it (DELETE /jobs/<id>, client disconnect, or the
+worker seeing a cancel request on the queue) kills the job's ffmpeg process
+groups at once; everything else stops at the next checkpoint - run_command,
+begin_stage, S3 part uploads, AI calls - by raising JobCancelled.
+
+JobCancelled derives from BaseException (like asyncio.CancelledError) so the
+`except Exception` fallbacks along the pipeline don't turn a cancel into a
+fallback result.
+"""
+import os
+import signal
+import threading
+import time
+from concurrent.futures import ALL_COMPLETED, FIRST_COMPLETED, wait
+from contextlib import contextmanager
+
+CANCEL_POLL_INTERVAL = float(os.getenv('CANCEL_POLL_INTERVAL', 0.5))
+
+_active = threading.local()
+_running = {}
+_running_lock = threading.Lock()
+
+
+class JobCancelled(BaseException):
+    """The job was cancelled; unwinds the job without fallbacks"""
+
+
+def get_cancel_token():
+    """CancelToken of the job running on this thread, or None"""
+    return getattr(_active, 'token', None)
+
+
+def check_cancelled():
+    """Raise JobCancelled if the current job was cancelled"""
+    token = get_cancel_token()
+    if token:
+        token.check()
+
+
+def wait_cancellable(futures, timeout=None, return_when=ALL_COMPLETED):
+    """concurrent.futures.wait that raises JobCancelled if the current job is cancelled meanwhile"""
+    token = get_cancel_token()
+    if token is None:
+        return wait(futures, timeout, return_when)
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while True:
+        token.check()
+        step = CANCEL_POLL_INTERVAL if deadline is None else \
+            max(0, min(CANCEL_POLL_INTERVAL, deadline - time.monotonic()))
+        done, pending = wait(futures, step, return_when)
+        if not pending or (done and return_when == FIRST_COMPLETED) or \
+                (deadline is not None and time.monotonic() >= deadline):
+            return done, pending
+
+
+@contextmanager
+def bound_to(token):
+    """Make work on this (pool) thread cancellable with another thread's job"""
+    previous = get_cancel_token()
+    _active.token = token
+    try:
+        yield
+    finally:
+        _active.token = previous
+
+
+class CancelToken:
+    def __init__(self):
+        self.event = threading.Event()
+        self.reason = None
+        self.requested_at = None
+        self.media_duration = None  # Lets run_command turn ffmpeg progress into reclaimed CPU
+        self.processes = set()
+        self.cleanups = []
+        self.stats = {'killed_processes': 0, 'killed_cpu_s': 0.0, 'reclaimed_cpu_s': 0.0,
+                      'ai_calls_skipped': 0}
+        self.lock = threading.Lock()
+
+    @property
+    def cancelled(self):
+        return self.event.is_set()
+
+    @contextmanager
+    def active(self):
+        """Make this the current thread's cancel token for the duration of the job"""
+        previous = get_cancel_token()
+        _active.token = self
+        try:
+            yield self
+        finally:
+            _active.token = previous
+
+    def cancel(self, reason='cancelled'):
+        """Request cancellation and kill the job's running processes; False if already cancelled"""
+        with self.lock:
+            if self.event.is_set():
+                return False
+            self.reason = reason
+            self.requested_at = time.monotonic()
+            self.event.set()
+            processes = list(self.processes)
+        for process in processes:
+            kill_process_group(process)
+        return True
+
+    def check(self):
+        if self.event.is_set():
+            raise JobCancelled(self.reason)
+
+    def add_process(self, process):
+        """Track a child; killed immediately if the job is already cancelled"""
+        with self.lock:
+            self.processes.add(process)
+            cancelled = self.event.is_set()
+        if cancelled:
+            kill_process_group(process)
+
+    def remove_process(self, process):
+        with self.lock:
+            self.processes.discard(process)
+
+    def record_kill(self, cpu_s, progress=None):
+        """Account a killed child: CPU it used, and the CPU it would still have
+        needed, extrapolated from its progress (0-1) when known"""
+        with self.lock:
+            self.stats['killed_processes'] += 1
+            self.stats['killed_cpu_s'] += cpu_s
+            if progress and 0 < progress < 1:
+                self.stats['reclaimed_cpu_s'] += cpu_s * (1 - progress) / progress
+
+    def count(self, stat, n=1):
+        with self.lock:
+            self.stats[stat] += n
+
+    def run_cleanups(self):
+        for cleanup in self.cleanups:
+            try:
+                cleanup()
+            except Exception as e:
+                print(f"Cancel cleanup error: {e}")
+
+    def report(self):
+        """Cancellation snapshot for the job's accounting"""
+        with self.lock:
+            return {
+                'reason': self.reason,
+                'latency_s': round(time.monotonic() - self.requested_at, 3) if self.requested_at else None,
+                'killed_processes': self.stats['killed_processes'],
+                'killed_cpu_s': round(self.stats['killed_cpu_s'], 3),
+                'reclaimed_cpu_s': round(self.stats['reclaimed_cpu_s'], 3),
+                'ai_calls_skipped': self.stats['ai_calls_skipped']
+            }
+
+
+def kill_process_group(process):
+    """SIGKILL the child and everything it spawned (it leads its own process group)"""
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+def register_job(job_id, token):
+    """Make a job running in this process cancellable by id"""
+    with _running_lock:
+        _running[job_id] = token
+
+
+def unregister_job(job_id):
+    with _running_lock:
+        _running.pop(job_id, None)
+
+
+def cancel_job(job_id, reason='cancelled'):
+    """Cancel a job running in this process; False if it isn't running here"""
+    with _running_lock:
+        token = _running.get(job_id)
+    if token is None:
+        return False
+    token.cancel(reason)
+    return True
@@ -0,0 +1,130 @@
+"""Keyframe sampling for multimodal content analysis.
+
+A handful of evenly spaced timestamps (snapped to the sync samples when the
+preflight keyframe table is known) are each grabbed by a short ffmpeg seek
+that decodes a single keyframe (-skip_frame nokey), scales it down and
+writes a JPEG to stdout - no full decode, nothing written by ffmpeg. The
+seeks run in parallel and the whole stage is bounded by FRAME_SAMPLE_BUDGET;
+frames that miss it are dropped.
+
+Frames are cached in the job's temp directory (frames/), so a retried job
+reuses them instead of seeking again.
+"""
+import bisect
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from accounting import charged_to, get_job_metrics, run_command
+from cancellation import bound_to, get_cancel_token
+
+FRAME_SAMPLING_ENABLED = os.getenv('FRAME_SAMPLING_ENABLED', 'true').lower() == 'true'
+FRAME_SAMPLE_BUDGET = float(os.getenv('FRAME_SAMPLE_BUDGET', 2))  # seconds for the whole stage
+FRAME_SAMPLE_MAX = int(os.getenv('FRAME_SAMPLE_MAX', 24))
+FRAMES_PER_SEGMENT = int(os.getenv('FRAMES_PER_SEGMENT', 2))
+FRAME_SAMPLE_WIDTH = int(os.getenv('FRAME_SAMPLE_WIDTH', 384))
+FRAME_SAMPLE_QUALITY = int(os.getenv('FRAME_SAMPLE_QUALITY', 6))  # mjpeg -q:v, 2 (best) - 31
+FRAME_SAMPLE_CONCURRENCY = int(os.getenv('FRAME_SAMPLE_CONCURRENCY', os.cpu_count() or 4))
+
+INDEX_FILE = 'index.json'
+
+
+def plan_sample_times(duration, segment_duration, keyframe_times=None):
+    """Evenly spaced timestamps, snapped to the preceding keyframe when the table is known"""
+    segment_count = max(1, int(-(-duration // segment_duration)))
+    count = min(FRAME_SAMPLE_MAX, segment_count * FRAMES_PER_SEGMENT)
+    times = [(i + 0.5) * duration / count for i in range(count)]
+    if keyframe_times:
+        times = [keyframe_times[max(0, bisect.bisect_right(keyframe_times, t) - 1)] for t in times]
+    return sorted(set(round(t, 3) for t in times))
+
+
+def grab_keyframe(input_path, timestamp, timeout):
+    """JPEG bytes of the keyframe at (or right after) `timestamp`, or None"""
+    cmd = [
+        'ffmpeg', '-v', 'error',
+        '-skip_frame', 'nokey',  # decode keyframes only
+        '-ss', f'{timestamp:.3f}', '-i', input_path,
+        '-map', '0:v:0', '-frames:v', '1',
+        '-vf', f'scale={FRAME_SAMPLE_WIDTH}:-2',
+        '-c:v', 'mjpeg', '-q:v', str(FRAME_SAMPLE_QUALITY),
+        '-f', 'image2pipe', 'pipe:1'
+    ]
+    result = run_command(cmd, timeout=timeout, text=False)
+    return result.stdout if result.returncode == 0 and result.stdout else None
+
+
+def load_cached_frames(cache_dir):
+    try:
+        with open(os.path.join(cache_dir, INDEX_FILE)) as f:
+            index = json.load(f)
+        frames = []
+        for entry in index:
+            with open(os.path.join(cache_dir, entry['file']), 'rb') as f:
+                frames.append(dict(entry, jpeg=f.read()))
+        return frames
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def save_frames(cache_dir, frames):
+    os.makedirs(cache_dir, exist_ok=True)
+    index = []
+    for i, frame in enumerate(frames):
+        filename = f'frame_{i:03d}.jpg'
+        with open(os.path.join(cache_dir, filename), 'wb') as f:
+            f.write(frame['jpeg'])
+        index.append({'segment': frame['segment'], 'time': frame['time'], 'file': filename})
+    with open(os.path.join(cache_dir, INDEX_FILE), 'w') as f:
+        json.dump(index, f)
+
+
+def sample_keyframes(input_path, duration, cache_dir, segment_duration=120, keyframe_times=None):
+    """Sample keyframes within FRAME_SAMPLE_BUDGET; returns (frames, stats).
+
+    Each frame is {'segment', 'time', 'jpeg'} (jpeg = bytes), ordered by time.
+    """
+    started = time.monotonic()
+    if not FRAME_SAMPLING_ENABLED or duration <= 0:
+        return [], {'requested': 0, 'sampled': 0, 'cached': False, 'elapsed_s': 0.0}
+
+    frames = load_cached_frames(cache_dir)
+    if frames is not None:
+        return frames, {'requested': len(frames), 'sampled': len(frames), 'cached': True,
+                        'elapsed_s': round(time.monotonic() - started, 3)}
+
+    times = plan_sample_times(duration, segment_duration, keyframe_times)
+    deadline = started + FRAME_SAMPLE_BUDGET
+    metrics = get_job_metrics()
+    token = get_cancel_token()
+
+    def grab(timestamp):
+        with charged_to(metrics), bound_to(token):
+            return grab_keyframe(input_path, timestamp, max(0.1, deadline - time.monotonic()))
+
+    # Every seek is its own ffmpeg process; the pool only bounds how many run at once
+    executor = ThreadPoolExecutor(max_workers=min(FRAME_SAMPLE_CONCURRENCY, len(times)))
+    futures = {executor.submit(grab, t): t for t in times}
+    done, _ = wait(futures, timeout=max(0, deadline - time.monotonic()))
+    executor.shutdown(wait=False, cancel_futures=True)
+
+    frames = []
+    for future in done:
+        if future.exception() is None and future.result():
+            t = futures[future]
+            frames.append({'segment': int(t // segment_duration), 'time': t, 'jpeg': future.result()})
+    frames.sort(key=lambda frame: frame['time'])
+
+    if frames:
+        try:
+            save_frames(cache_dir, frames)
+        except OSError as e:
+            print(f"Frame cache error: {e}")
+    return frames, {'requested': len(times), 'sampled': len(frames), 'cached': False,
+                    'elapsed_s': round(time.monotonic() - started, 3)}
+
+
+def describe_frames(frames):
+    """Frame list for metadata (no image bytes)"""
+    return [{'segment': frame['segment'], 'time': frame['time'], 'bytes': len(frame['jpeg'])} for frame in frames]
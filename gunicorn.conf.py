@@ -0,0 +1,21 @@
+import os
+
+# Worker model: 'sync' (one request per worker) or 'gevent' (cooperative
+# I/O - ffmpeg, S3 and status requests yield instead of blocking the worker)
+worker_mode = os.getenv('WORKER_MODE', 'sync')
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+workers = int(os.getenv('WEB_CONCURRENCY', 4))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 30))
+
+if worker_mode == 'gevent':
+    worker_class = 'gevent'
+    # Concurrent requests held per worker process
+    worker_connections = int(os.getenv('WORKER_CONNECTIONS', 1000))
+
+
+def post_worker_init(worker):
+    if worker_mode == 'gevent':
+        # Real OS threads used by run_blocking for calls that cannot yield (gRPC)
+        from gevent import get_hub
+        get_hub().threadpool.maxsize = int(os.getenv('BLOCKING_THREADPOOL_SIZE', 64))
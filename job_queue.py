@@ -0,0 +1,349 @@
+"""Durable processing job queue shared by web nodes and workers.
+
+Web nodes enqueue jobs; workers (python -m worker) lease them with a
+visibility timeout and keep the lease alive with heartbeats. A job whose
+lease expires (crashed or stuck worker) becomes visible again and is retried
+until max_attempts is reached.
+
+cancel() drops a queued job at once; for a leased job it sets a flag the
+holding worker polls (cancel_requested) before it reports the job cancelled.
+
+Backends:
+- SQLiteJobQueue: single box / tests (a file on local disk)
+- RedisJobQueue: clusters (any Redis-compatible server)
+"""
+import json
+import sqlite3
+import time
+import uuid
+
+# Job states
+QUEUED = 'queued'
+LEASED = 'leased'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+
+
+class SQLiteJobQueue:
+    def __init__(self, path='jobs.sqlite3'):
+        self.path = path
+        with self.connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    state TEXT NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    max_attempts INTEGER NOT NULL,
+                    worker TEXT,
+                    lease_expires REAL,
+                    result TEXT,
+                    error TEXT,
+                    cancel_requested INTEGER NOT NULL DEFAULT 0,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, created_at)")
+            columns = [row['name'] for row in conn.execute("PRAGMA table_info(jobs)")]
+            if 'cancel_requested' not in columns:
+                conn.execute("ALTER TABLE jobs ADD COLUMN cancel_requested INTEGER NOT NULL DEFAULT 0")
+
+    def connect(self):
+        """New connection per call so threads/greenlets never share one"""
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode=WAL')
+        return conn
+
+    def enqueue(self, kind, payload, max_attempts=3, job_id=None):
+        """Add a job and return its id"""
+        job_id = job_id or str(uuid.uuid4())
+        now = time.time()
+        with self.connect() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, kind, payload, state, max_attempts, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (job_id, kind, json.dumps(payload), QUEUED, max_attempts, now, now)
+            )
+        return job_id
+
+    def lease(self, worker_id, visibility_timeout):
+        """Take the oldest visible job (queued, or leased with an expired lease)"""
+        now = time.time()
+        conn = self.connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute(
+                "UPDATE jobs SET state = ?, worker = NULL, updated_at = ? "
+                "WHERE state = ? AND lease_expires < ? AND cancel_requested = 1",
+                (CANCELLED, now, LEASED, now)
+            )
+            conn.execute(
+                "UPDATE jobs SET state = ?, error = ?, worker = NULL, updated_at = ? "
+                "WHERE state = ? AND lease_expires < ? AND attempts >= max_attempts",
+                (FAILED, 'Lease expired on final attempt', now, LEASED, now)
+            )
+            row = conn.execute(
+                "SELECT id FROM jobs WHERE state = ? OR (state = ? AND lease_expires < ?) "
+                "ORDER BY created_at LIMIT 1",
+                (QUEUED, LEASED, now)
+            ).fetchone()
+            if row is None:
+                conn.execute('COMMIT')
+                return None
+            conn.execute(
+                "UPDATE jobs SET state = ?, worker = ?, lease_expires = ?, attempts = attempts + 1, "
+                "updated_at = ? WHERE id = ?",
+                (LEASED, worker_id, now + visibility_timeout, now, row['id'])
+            )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+        return self.get(row['id'])
+
+    def heartbeat(self, job_id, worker_id, visibility_timeout):
+        """Extend the lease; False if the job is no longer held by this worker"""
+        now = time.time()
+        with self.connect() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET lease_expires = ?, updated_at = ? WHERE id = ? AND worker = ? AND state = ?",
+                (now + visibility_timeout, now, job_id, worker_id, LEASED)
+            )
+        return cursor.rowcount == 1
+
+    def complete(self, job_id, worker_id, result):
+        """Store the result of a leased job"""
+        with self.connect() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET state = ?, result = ?, worker = NULL, lease_expires = NULL, updated_at = ? "
+                "WHERE id = ? AND worker = ? AND state = ?",
+                (DONE, json.dumps(result), time.time(), job_id, worker_id, LEASED)
+            )
+        return cursor.rowcount == 1
+
+    def fail(self, job_id, worker_id, error):
+        """Release a leased job for retry, or mark it failed after its last attempt"""
+        with self.connect() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET state = CASE WHEN attempts >= max_attempts THEN ? ELSE ? END, "
+                "error = ?, worker = NULL, lease_expires = NULL, updated_at = ? "
+                "WHERE id = ? AND worker = ? AND state = ?",
+                (FAILED, QUEUED, str(error), time.time(), job_id, worker_id, LEASED)
+            )
+        return cursor.rowcount == 1
+
+    def cancel(self, job_id):
+        """Cancel a job: queued ones at once, leased ones via the worker; returns the job state or None"""
+        now = time.time()
+        with self.connect() as conn:
+            conn.execute("UPDATE jobs SET state = ?, updated_at = ? WHERE id = ? AND state = ?",
+                         (CANCELLED, now, job_id, QUEUED))
+            conn.execute("UPDATE jobs SET cancel_requested = 1, updated_at = ? WHERE id = ? AND state = ?",
+                         (now, job_id, LEASED))
+            row = conn.execute("SELECT state FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return row['state'] if row else None
+
+    def cancel_requested(self, job_id):
+        """True once cancel() was called on this leased job"""
+        with self.connect() as conn:
+            row = conn.execute("SELECT cancel_requested FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return bool(row and row['cancel_requested'])
+
+    def mark_cancelled(self, job_id, worker_id, result):
+        """Record that the worker holding the job stopped it"""
+        with self.connect() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET state = ?, result = ?, worker = NULL, lease_expires = NULL, updated_at = ? "
+                "WHERE id = ? AND worker = ? AND state = ?",
+                (CANCELLED, json.dumps(result), time.time(), job_id, worker_id, LEASED)
+            )
+        return cursor.rowcount == 1
+
+    def get(self, job_id):
+        """Job record as a dict, or None"""
+        with self.connect() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job['payload'] = json.loads(job['payload'])
+        job['result'] = json.loads(job['result']) if job['result'] else None
+        job['cancel_requested'] = bool(job['cancel_requested'])
+        return job
+
+
+class RedisJobQueue:
+    # Reclaim expired leases, then pop the next queued id and lease it
+    LEASE_SCRIPT = """
+        local expired = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', ARGV[1])
+        for _, id in ipairs(expired) do
+            redis.call('ZREM', KEYS[2], id)
+            local key = ARGV[4] .. id
+            if redis.call('HGET', key, 'cancel_requested') == '1' then
+                redis.call('HSET', key, 'state', 'cancelled', 'worker', '', 'updated_at', ARGV[1])
+            elseif tonumber(redis.call('HGET', key, 'attempts')) >= tonumber(redis.call('HGET', key, 'max_attempts')) then
+                redis.call('HSET', key, 'state', 'failed', 'error', 'Lease expired on final attempt',
+                           'worker', '', 'updated_at', ARGV[1])
+            else
+                redis.call('HSET', key, 'state', 'queued', 'worker', '', 'updated_at', ARGV[1])
+                redis.call('RPUSH', KEYS[1], id)
+            end
+        end
+        local id = redis.call('LPOP', KEYS[1])
+        if not id then
+            return false
+        end
+        local key = ARGV[4] .. id
+        redis.call('ZADD', KEYS[2], ARGV[2], id)
+        redis.call('HSET', key, 'state', 'leased', 'worker', ARGV[3], 'lease_expires', ARGV[2], 'updated_at', ARGV[1])
+        redis.call('HINCRBY', key, 'attempts', 1)
+        return id
+    """
+
+    # Only the worker holding the lease may extend or finish it
+    HEARTBEAT_SCRIPT = """
+        local key = ARGV[3] .. ARGV[1]
+        if redis.call('HGET', key, 'worker') ~= ARGV[2] or redis.call('HGET', key, 'state') ~= 'leased' then
+            return 0
+        end
+        redis.call('ZADD', KEYS[1], ARGV[4], ARGV[1])
+        redis.call('HSET', key, 'lease_expires', ARGV[4], 'updated_at', ARGV[5])
+        return 1
+    """
+
+    FINISH_SCRIPT = """
+        local key = ARGV[3] .. ARGV[1]
+        if redis.call('HGET', key, 'worker') ~= ARGV[2] or redis.call('HGET', key, 'state') ~= 'leased' then
+            return 0
+        end
+        redis.call('ZREM', KEYS[2], ARGV[1])
+        local state = ARGV[4]
+        if state == 'retry' then
+            if tonumber(redis.call('HGET', key, 'attempts')) >= tonumber(redis.call('HGET', key, 'max_attempts')) then
+                state = 'failed'
+            else
+                state = 'queued'
+                redis.call('RPUSH', KEYS[1], ARGV[1])
+            end
+        end
+        redis.call('HSET', key, 'state', state, ARGV[5], ARGV[6], 'worker', '', 'lease_expires', '', 'updated_at', ARGV[7])
+        return 1
+    """
+
+    CANCEL_SCRIPT = """
+        local key = ARGV[2] .. ARGV[1]
+        local state = redis.call('HGET', key, 'state')
+        if state == 'queued' then
+            redis.call('LREM', KEYS[1], 0, ARGV[1])
+            redis.call('HSET', key, 'state', 'cancelled', 'updated_at', ARGV[3])
+            return 'cancelled'
+        elseif state == 'leased' then
+            redis.call('HSET', key, 'cancel_requested', 1, 'updated_at', ARGV[3])
+        end
+        return state
+    """
+
+    def __init__(self, url='redis://localhost:6379/0', prefix='videosplitter:'):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("JOB_QUEUE_BACKEND=redis requires the 'redis' package")
+        self.redis = redis.Redis.from_url(url, decode_responses=True)
+        self.prefix = prefix
+        self.queued_key = f'{prefix}queued'
+        self.leased_key = f'{prefix}leased'
+        self.job_prefix = f'{prefix}job:'
+        self.lease_script = self.redis.register_script(self.LEASE_SCRIPT)
+        self.heartbeat_script = self.redis.register_script(self.HEARTBEAT_SCRIPT)
+        self.finish_script = self.redis.register_script(self.FINISH_SCRIPT)
+        self.cancel_script = self.redis.register_script(self.CANCEL_SCRIPT)
+
+    def enqueue(self, kind, payload, max_attempts=3, job_id=None):
+        """Add a job and return its id"""
+        job_id = job_id or str(uuid.uuid4())
+        now = time.time()
+        pipe = self.redis.pipeline()
+        pipe.hset(self.job_prefix + job_id, mapping={
+            'id': job_id, 'kind': kind, 'payload': json.dumps(payload), 'state': QUEUED,
+            'attempts': 0, 'max_attempts': max_attempts, 'created_at': now, 'updated_at': now
+        })
+        pipe.rpush(self.queued_key, job_id)
+        pipe.execute()
+        return job_id
+
+    def lease(self, worker_id, visibility_timeout):
+        """Take the next visible job, reclaiming expired leases first"""
+        now = time.time()
+        job_id = self.lease_script(keys=[self.queued_key, self.leased_key],
+                                   args=[now, now + visibility_timeout, worker_id, self.job_prefix])
+        return self.get(job_id) if job_id else None
+
+    def heartbeat(self, job_id, worker_id, visibility_timeout):
+        """Extend the lease; False if the job is no longer held by this worker"""
+        now = time.time()
+        return bool(self.heartbeat_script(keys=[self.leased_key],
+                                          args=[job_id, worker_id, self.job_prefix, now + visibility_timeout, now]))
+
+    def complete(self, job_id, worker_id, result):
+        """Store the result of a leased job"""
+        return bool(self.finish_script(keys=[self.queued_key, self.leased_key],
+                                       args=[job_id, worker_id, self.job_prefix, DONE,
+                                             'result', json.dumps(result), time.time()]))
+
+    def fail(self, job_id, worker_id, error):
+        """Release a leased job for retry, or mark it failed after its last attempt"""
+        return bool(self.finish_script(keys=[self.queued_key, self.leased_key],
+                                       args=[job_id, worker_id, self.job_prefix, 'retry',
+                                             'error', str(error), time.time()]))
+
+    def cancel(self, job_id):
+        """Cancel a job: queued ones at once, leased ones via the worker; returns the job state or None"""
+        return self.cancel_script(keys=[self.queued_key], args=[job_id, self.job_prefix, time.time()])
+
+    def cancel_requested(self, job_id):
+        """True once cancel() was called on this leased job"""
+        return self.redis.hget(self.job_prefix + job_id, 'cancel_requested') == '1'
+
+    def mark_cancelled(self, job_id, worker_id, result):
+        """Record that the worker holding the job stopped it"""
+        return bool(self.finish_script(keys=[self.queued_key, self.leased_key],
+                                       args=[job_id, worker_id, self.job_prefix, CANCELLED,
+                                             'result', json.dumps(result), time.time()]))
+
+    def get(self, job_id):
+        """Job record as a dict, or None"""
+        data = self.redis.hgetall(self.job_prefix + job_id)
+        if not data:
+            return None
+        return {
+            'id': data['id'],
+            'kind': data['kind'],
+            'payload': json.loads(data['payload']),
+            'state': data['state'],
+            'attempts': int(data.get('attempts', 0)),
+            'max_attempts': int(data.get('max_attempts', 0)),
+            'worker': data.get('worker') or None,
+            'lease_expires': float(data['lease_expires']) if data.get('lease_expires') else None,
+            'result': json.loads(data['result']) if data.get('result') else None,
+            'error': data.get('error') or None,
+            'cancel_requested': data.get('cancel_requested') == '1',
+            'created_at': float(data['created_at']),
+            'updated_at': float(data['updated_at'])
+        }
+
+
+def create_job_queue(backend, path='jobs.sqlite3', url=None):
+    """Build the configured backend ('sqlite' or 'redis'); None disables queueing"""
+    if not backend:
+        return None
+    if backend == 'sqlite':
+        return SQLiteJobQueue(path)
+    if backend == 'redis':
+        return RedisJobQueue(url or 'redis://localhost:6379/0')
+    raise ValueError(f"Unknown JOB_QUEUE_BACKEND: {backend}")
@@ -0,0 +1,418 @@
+"""Container preflight for MP4/MOV (ISO-BMFF) without ffprobe.
+
+Only box headers and the moov box are read - from a local file through
+mmap, or from S3 through ranged GETs - so a corrupt upload or one without
+a video stream is rejected in milliseconds, before the full download.
+
+Containers that aren't ISO-BMFF (MKV, WebM, AVI...) aren't parsed here;
+probe_mp4 returns None for them and callers fall back to ffprobe.
+
+sniff_streamable tells from the first bytes of an upload whether it can be
+split while it is still arriving (streaming ingest).
+"""
+import mmap
+import os
+import struct
+
+MAX_MOOV_SIZE = 64 * 1024 * 1024
+S3_READ_BLOCK = 64 * 1024
+MAX_TOP_LEVEL_BOXES = 32  # each can be a ranged GET on S3; past this, leave it to ffprobe
+
+EBML_MAGIC = b'\x1a\x45\xdf\xa3'  # Matroska / WebM
+TS_SYNC_BYTE = 0x47
+TS_PACKET_SIZE = 188
+
+# Boxes whose payload is just child boxes
+CONTAINER_BOXES = {b'moov', b'trak', b'mdia', b'minf', b'stbl', b'mvex', b'edts'}
+
+
+class PreflightError(Exception):
+    """The upload is an MP4/MOV but is corrupt, truncated or unusable"""
+
+
+class FileReader:
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        self.size = os.fstat(self.file.fileno()).st_size
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if self.size else None
+
+    def read(self, offset, length):
+        if not self.map:
+            return b''
+        return self.map[offset:offset + length]
+
+    def close(self):
+        if self.map:
+            self.map.close()
+        self.file.close()
+
+
+class S3RangeReader:
+    """Ranged GETs, at least S3_READ_BLOCK bytes each, with the last block cached"""
+    def __init__(self, client, bucket, key):
+        self.client = client
+        self.bucket = bucket
+        self.key = key
+        self.size = client.head_object(Bucket=bucket, Key=key)['ContentLength']
+        self.block_offset = None
+        self.block = b''
+        self.requests = 0
+        self.bytes_fetched = 0
+
+    def read(self, offset, length):
+        if self.block_offset is not None and self.block_offset <= offset and \
+                offset + length <= self.block_offset + len(self.block):
+            start = offset - self.block_offset
+            return self.block[start:start + length]
+        if offset >= self.size:
+            return b''
+        end = min(self.size, offset + max(length, S3_READ_BLOCK)) - 1
+        response = self.client.get_object(Bucket=self.bucket, Key=self.key, Range=f'bytes={offset}-{end}')
+        self.block = response['Body'].read()
+        self.block_offset = offset
+        self.requests += 1
+        self.bytes_fetched += len(self.block)
+        return self.block[:length]
+
+    def close(self):
+        pass
+
+
+def iter_boxes(data, offset=0, end=None):
+    """(type, payload_start, box_end) for each box in an in-memory buffer"""
+    end = len(data) if end is None else end
+    while offset + 8 <= end:
+        size, box_type = struct.unpack_from('>I4s', data, offset)
+        header = 8
+        if size == 1:
+            if offset + 16 > end:
+                raise PreflightError(f"Truncated '{box_type.decode('latin-1')}' box header")
+            size = struct.unpack_from('>Q', data, offset + 8)[0]
+            header = 16
+        elif size == 0:
+            size = end - offset
+        if size < header or offset + size > end:
+            raise PreflightError(f"Corrupt '{box_type.decode('latin-1')}' box at offset {offset}")
+        yield box_type, offset + header, offset + size
+        offset += size
+
+
+def read_top_level_boxes(reader):
+    """Walk the file's top-level boxes reading only their headers.
+
+    Stops one box past the moov (a faststart file's mdat, still checked for
+    truncation): the moof/mdat pairs of a fragmented file can run to
+    thousands. Returns None if there is no moov within MAX_TOP_LEVEL_BOXES.
+    """
+    boxes = []
+    offset = 0
+    moov_found = False
+    while offset + 8 <= reader.size:
+        if len(boxes) >= MAX_TOP_LEVEL_BOXES:
+            return None
+        header = reader.read(offset, 16)
+        size, box_type = struct.unpack_from('>I4s', header)
+        header_size = 8
+        if size == 1:
+            size = struct.unpack_from('>Q', header, 8)[0]
+            header_size = 16
+        elif size == 0:
+            size = reader.size - offset
+        if size < header_size:
+            raise PreflightError(f"Corrupt '{box_type.decode('latin-1')}' box at offset {offset}")
+        if offset + size > reader.size:
+            raise PreflightError(f"Truncated file: '{box_type.decode('latin-1')}' box ends past the end "
+                                 f"({offset + size} > {reader.size} bytes)")
+        boxes.append((box_type, offset, header_size, size))
+        if moov_found:
+            break
+        moov_found = box_type == b'moov'
+        offset += size
+    return boxes
+
+
+def full_box_version(data, start):
+    return data[start]
+
+
+def parse_sample_times(stts, stss):
+    """Decode times (in media timescale units) of the sync samples"""
+    times = []
+    sync = iter(stss)
+    target = next(sync, None)
+    sample, time = 1, 0
+    for count, delta in stts:
+        while target is not None and target < sample + count:
+            times.append(time + (target - sample) * delta)
+            target = next(sync, None)
+        sample += count
+        time += count * delta
+        if target is None:
+            break
+    return times
+
+
+def composition_offsets(ctts, samples):
+    """ctts offset (media timescale units) of each of the given ascending sample numbers"""
+    offsets = []
+    runs = iter(ctts)
+    first, (count, offset) = 1, next(runs, (0, 0))
+    for target in samples:
+        while target >= first + count and count:
+            first += count
+            count, offset = next(runs, (0, 0))
+        offsets.append(offset if target < first + count else 0)
+    return offsets
+
+
+def presentation_shift(edits, movie_timescale, timescale):
+    """(media time the presentation starts at, leading empty-edit delay in seconds) from elst.
+
+    Only the leading empty edits and the first real edit are applied, like
+    ffmpeg's default handling of a plain trim or delay; (None, 0) without edits.
+    """
+    delay = 0
+    for duration, media_time in edits:
+        if media_time == -1:
+            delay += duration / movie_timescale if movie_timescale else 0
+        else:
+            return media_time, delay
+    return None, delay
+
+
+def parse_trak(data, start, end, movie_timescale=None):
+    track = {'type': None, 'codec': None}
+    stts, stss, ctts, edits, timescale = [], None, [], [], None
+    stack = [(start, end)]
+    while stack:
+        box_start, box_end = stack.pop()
+        for box_type, payload, child_end in iter_boxes(data, box_start, box_end):
+            if box_type in CONTAINER_BOXES:
+                stack.append((payload, child_end))
+            elif box_type == b'tkhd':
+                version = full_box_version(data, payload)
+                track['id'] = struct.unpack_from('>I', data, payload + (20 if version == 1 else 12))[0]
+                dims = payload + (88 if version == 1 else 76)
+                if dims + 8 <= child_end:
+                    width, height = struct.unpack_from('>II', data, dims)
+                    track['width'], track['height'] = width >> 16, height >> 16
+            elif box_type == b'mdhd':
+                version = full_box_version(data, payload)
+                if version == 1:
+                    timescale, duration = struct.unpack_from('>IQ', data, payload + 20)
+                else:
+                    timescale, duration = struct.unpack_from('>II', data, payload + 12)
+                track['timescale'] = timescale
+                track['duration'] = round(duration / timescale, 3) if timescale else 0
+            elif box_type == b'hdlr':
+                handler = data[payload + 8:payload + 12]
+                track['type'] = {b'vide': 'video', b'soun': 'audio', b'text': 'text',
+                                 b'sbtl': 'subtitle'}.get(handler, handler.decode('latin-1'))
+            elif box_type == b'stsd':
+                if struct.unpack_from('>I', data, payload + 4)[0]:
+                    track['codec'] = data[payload + 12:payload + 16].decode('latin-1')
+            elif box_type == b'stts':
+                count = struct.unpack_from('>I', data, payload + 4)[0]
+                stts = [struct.unpack_from('>II', data, payload + 8 + 8 * i) for i in range(count)]
+            elif box_type == b'stss':
+                count = struct.unpack_from('>I', data, payload + 4)[0]
+                stss = struct.unpack_from(f'>{count}I', data, payload + 8)
+            elif box_type == b'ctts':
+                # Offsets are read as signed in both versions (so does ffmpeg)
+                count = struct.unpack_from('>I', data, payload + 4)[0]
+                ctts = [struct.unpack_from('>Ii', data, payload + 8 + 8 * i) for i in range(count)]
+            elif box_type == b'elst':
+                version = full_box_version(data, payload)
+                count = struct.unpack_from('>I', data, payload + 4)[0]
+                fmt, entry_size = ('>Qq', 20) if version == 1 else ('>Ii', 12)
+                edits = [struct.unpack_from(fmt, data, payload + 8 + entry_size * i) for i in range(count)]
+            elif box_type == b'stsz':
+                track['sample_count'] = struct.unpack_from('>I', data, payload + 8)[0]
+    # Presentation times (what ffmpeg cuts on): decode time + ctts offset, moved by the edit list
+    media_time, delay = presentation_shift(edits, movie_timescale, timescale)
+    if not timescale:
+        to_seconds = lambda t: 0
+    elif media_time is None:
+        to_seconds = lambda t: t / timescale
+    else:
+        to_seconds = lambda t: (t - media_time) / timescale + delay
+    track['start_time'] = to_seconds(composition_offsets(ctts, [1])[0] if media_time is None else media_time)
+    if stss is None:
+        # No stss: every sample is a sync sample (audio, intra-only video)
+        track['keyframe_times'] = None
+    else:
+        offsets = composition_offsets(ctts, stss)
+        track['keyframe_times'] = sorted(to_seconds(t + offset)
+                                         for t, offset in zip(parse_sample_times(stts, stss), offsets))
+    return track
+
+
+def parse_moov(data):
+    info = {'duration': 0, 'fragmented': False, 'tracks': []}
+    for box_type, payload, end in iter_boxes(data):
+        if box_type == b'mvhd':
+            version = full_box_version(data, payload)
+            if version == 1:
+                timescale, duration = struct.unpack_from('>IQ', data, payload + 20)
+            else:
+                timescale, duration = struct.unpack_from('>II', data, payload + 12)
+            info['duration'] = round(duration / timescale, 3) if timescale else 0
+            info['timescale'] = timescale
+        elif box_type == b'trak':
+            info['tracks'].append(parse_trak(data, payload, end, info.get('timescale')))
+        elif box_type == b'mvex':
+            info['fragmented'] = True
+            for child, child_payload, _ in iter_boxes(data, payload, end):
+                if child == b'mehd' and info.get('timescale'):
+                    version = full_box_version(data, child_payload)
+                    fmt = '>Q' if version == 1 else '>I'
+                    info['duration'] = info['duration'] or round(
+                        struct.unpack_from(fmt, data, child_payload + 4)[0] / info['timescale'], 3)
+    # ffmpeg rebases output timestamps to the earliest track start; keyframes it
+    # drops (presented before the start) can't be cut points
+    info['start_time'] = min((track['start_time'] for track in info['tracks']), default=0)
+    for track in info['tracks']:
+        if track['keyframe_times'] is not None:
+            track['keyframe_times'] = [round(t - info['start_time'], 3) for t in track['keyframe_times']
+                                       if t >= info['start_time']]
+        track['start_time'] = round(track['start_time'], 3)
+    info['start_time'] = round(info['start_time'], 3)
+    return info
+
+
+def plan_cut_points(keyframe_times, segment_duration):
+    """First keyframe at or after each segment boundary (where a stream-copy split cuts).
+
+    Like ffmpeg's segment muxer, boundaries are multiples of segment_duration
+    counted in segments, not measured from the previous cut. keyframe_times are
+    presentation times (ctts and the edit list applied); edit lists with more
+    than one real edit are only honoured up to the first, so a cut can be off
+    on those.
+    """
+    cuts = [0.0]
+    for t in keyframe_times:
+        if t >= len(cuts) * segment_duration:
+            cuts.append(t)
+    return cuts
+
+
+def probe_mp4(reader, segment_duration=None):
+    """Duration, tracks, codecs and sync-sample table from the header boxes.
+
+    Returns None if the data isn't ISO-BMFF, or its layout or moov is too
+    large to read cheaply; raises PreflightError if it is but can't be used
+    (truncated, no moov, no video).
+    """
+    if reader.size < 8 or reader.read(4, 4) != b'ftyp':
+        return None
+
+    boxes = read_top_level_boxes(reader)
+    if boxes is None:
+        return None
+    ftyp = reader.read(boxes[0][1] + boxes[0][2], min(boxes[0][3] - boxes[0][2], 256))
+    moov = next((box for box in boxes if box[0] == b'moov'), None)
+    if moov is None:
+        raise PreflightError('No moov box: upload is truncated or not a finished recording')
+    if moov[3] > MAX_MOOV_SIZE:
+        return None  # A long but valid file: leave it to ffprobe
+    mdat = next((box for box in boxes if box[0] == b'mdat'), None)
+
+    try:
+        info = parse_moov(reader.read(moov[1] + moov[2], moov[3] - moov[2]))
+    except (struct.error, IndexError, UnicodeDecodeError):
+        raise PreflightError('Corrupt moov box: a sample table is cut short')
+    info.update({
+        'container': 'mp4',
+        'major_brand': ftyp[:4].decode('latin-1'),
+        'compatible_brands': [ftyp[i:i + 4].decode('latin-1') for i in range(8, len(ftyp) - 3, 4)],
+        'faststart': mdat is None or moov[1] < mdat[1],
+        'file_size': reader.size
+    })
+
+    video = next((t for t in info['tracks'] if t['type'] == 'video'), None)
+    if video is None:
+        raise PreflightError('No video stream')
+    if not info['duration'] and not info['fragmented']:
+        raise PreflightError('Video has zero duration')
+    if video.get('keyframe_times') and segment_duration:
+        info['cut_points'] = plan_cut_points(video['keyframe_times'], segment_duration)
+    return info
+
+
+def sniff_streamable(head):
+    """Container of an upload's first bytes if it can be demuxed from a pipe:
+    'matroska' (MKV/WebM), 'mpegts' or 'fmp4'.
+
+    False if it can't - a regular MP4 (no sample can be read before its
+    moov, often at the end), AVI, FLV... - and None if more bytes are needed
+    to tell.
+    """
+    if len(head) < 8:
+        return None
+    if head[:4] == EBML_MAGIC:
+        return 'matroska'
+    if head[0] == TS_SYNC_BYTE:
+        if len(head) < 2 * TS_PACKET_SIZE + 1:
+            return None
+        return 'mpegts' if head[TS_PACKET_SIZE] == head[2 * TS_PACKET_SIZE] == TS_SYNC_BYTE else False
+    if head[4:8] != b'ftyp':
+        return False
+
+    offset = 0
+    while offset + 16 <= len(head):
+        size, box_type = struct.unpack_from('>I4s', head, offset)
+        header = 8
+        if size == 1:
+            size = struct.unpack_from('>Q', head, offset + 8)[0]
+            header = 16
+        if size < header:  # Also size 0: a last box running to the end of the file
+            return False
+        if box_type == b'moov':
+            if size > MAX_MOOV_SIZE:
+                return False
+            if offset + size > len(head):
+                return None
+            try:
+                info = parse_moov(head[offset + header:offset + size])
+            except (PreflightError, struct.error, IndexError, UnicodeDecodeError):
+                return False
+            return 'fmp4' if info['fragmented'] else False
+        if box_type in (b'mdat', b'moof'):
+            return False  # Media ahead of the moov
+        offset += size
+    return None
+
+
+def preflight_file(path, segment_duration=None):
+    reader = FileReader(path)
+    try:
+        return probe_mp4(reader, segment_duration)
+    finally:
+        reader.close()
+
+
+def preflight_s3_object(client, bucket, key, segment_duration=None):
+    reader = S3RangeReader(client, bucket, key)
+    info = probe_mp4(reader, segment_duration)
+    if info is not None:
+        info['s3_requests'] = reader.requests
+        info['s3_bytes_fetched'] = reader.bytes_fetched
+    return info
+
+
+def video_keyframe_times(info):
+    """Keyframe times (seconds) of the first video track, or None"""
+    if not info:
+        return None
+    return next((t.get('keyframe_times') for t in info['tracks'] if t['type'] == 'video'), None)
+
+
+def summarize(info):
+    """Preflight result without the per-keyframe tables (for API responses)"""
+    tracks = []
+    for track in info['tracks']:
+        track = dict(track)
+        keyframe_times = track.pop('keyframe_times', None)
+        track['keyframes'] = len(keyframe_times) if keyframe_times is not None else None
+        tracks.append(track)
+    return dict(info, tracks=tracks)
@@ -0,0 +1,191 @@
+"""Node-local cache of source videos downloaded from S3.
+
+Entries are keyed by S3 object key + ETag, so re-running a video (another
+segment length or output mode) skips the download, and a re-uploaded object
+never serves stale bytes.
+
+The directory is shared by every process on the node (web workers and
+`python -m worker`), so the bookkeeping lives in the filesystem:
+- a job holds a shared flock on the file while it uses it (the refcount);
+  eviction only deletes files it can lock exclusively
+- a per-entry .lock file is held exclusively while filling, so concurrent
+  jobs for the same object wait for one download instead of starting their own
+  (for at most FILL_WAIT_TIMEOUT, and cancellably); lock files are never
+  deleted, since another process may hold or be about to take one
+- files are written to a .part name and renamed into place when complete
+- LRU order is the file mtime, touched on every hit
+"""
+import fcntl
+import hashlib
+import os
+import threading
+import time
+import uuid
+
+from cancellation import check_cancelled
+
+LOCK_POLL_INTERVAL = 0.2  # flock is polled (LOCK_NB) so gevent workers keep serving
+STALE_PART_SECONDS = 3600
+FILL_WAIT_TIMEOUT = float(os.getenv('SOURCE_CACHE_FILL_WAIT', 600))
+
+
+class SourceCacheBusy(Exception):
+    """Another job's download of the object didn't finish within FILL_WAIT_TIMEOUT"""
+
+
+class SourceHandle:
+    """A source video in use by a job; release() when done with the file"""
+    def __init__(self, path, status, fd=None, cache=None):
+        self.path = path
+        self.status = status  # 'hit', 'miss' (this job downloaded it), 'shared' (waited on another download) or 'uncached'
+        self.fd = fd
+        self.cache = cache
+
+    def release(self):
+        if self.fd is not None:
+            os.close(self.fd)  # drops the shared lock
+            self.fd = None
+            if self.cache:
+                self.cache.evict()
+
+
+def lock(fd, operation, blocking=True, timeout=None):
+    """flock, polling instead of blocking in the kernel; False if busy (not blocking, or past timeout).
+
+    Raises JobCancelled if the current job is cancelled while waiting.
+    """
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while True:
+        try:
+            fcntl.flock(fd, operation | fcntl.LOCK_NB)
+            return True
+        except BlockingIOError:
+            if not blocking or (deadline is not None and time.monotonic() >= deadline):
+                return False
+            check_cancelled()
+            time.sleep(LOCK_POLL_INTERVAL)
+
+
+class SourceCache:
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.stats = {'hits': 0, 'misses': 0, 'shared': 0, 'evictions': 0, 'bytes_evicted': 0}
+        self.stats_lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def entry_path(self, key, etag, extension=''):
+        digest = hashlib.sha256(f'{key}\0{etag}'.encode()).hexdigest()[:40]
+        return os.path.join(self.directory, digest + extension)
+
+    def count(self, stat, n=1):
+        with self.stats_lock:
+            self.stats[stat] += n
+
+    def open_entry(self, path):
+        """Shared-lock an existing entry; None if it isn't there (or was evicted meanwhile)"""
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except FileNotFoundError:
+            return None
+        try:
+            lock(fd, fcntl.LOCK_SH)
+            if os.fstat(fd).st_ino == os.stat(path).st_ino:
+                os.utime(path)  # LRU
+                return fd
+        except FileNotFoundError:
+            pass
+        except BaseException:
+            os.close(fd)
+            raise
+        os.close(fd)
+        return None
+
+    def acquire(self, key, etag, fill, extension=''):
+        """SourceHandle for the object, running fill(path) -> bool on a miss; None if the fill failed.
+
+        Raises SourceCacheBusy if another job's fill of the object takes too long.
+        """
+        path = self.entry_path(key, etag, extension)
+        waited = False
+        while True:
+            fd = self.open_entry(path)
+            if fd is not None:
+                self.count('shared' if waited else 'hits')
+                return SourceHandle(path, 'shared' if waited else 'hit', fd, self)
+
+            lock_fd = os.open(path + '.lock', os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                if not lock(lock_fd, fcntl.LOCK_EX, blocking=False):
+                    # Another job is downloading it: wait, then use its file
+                    waited = True
+                    if not lock(lock_fd, fcntl.LOCK_EX, timeout=FILL_WAIT_TIMEOUT):
+                        raise SourceCacheBusy(f'{key} is still being downloaded by another job')
+                    continue
+                fd = self.open_entry(path)  # Filled while we were getting the lock
+                if fd is not None:
+                    self.count('hits')
+                    return SourceHandle(path, 'hit', fd, self)
+
+                part_path = f'{path}.{uuid.uuid4().hex[:8]}.part'
+                try:
+                    if not fill(part_path):
+                        return None
+                    os.replace(part_path, path)
+                finally:
+                    if os.path.exists(part_path):
+                        os.remove(part_path)
+                fd = self.open_entry(path)
+                if fd is None:
+                    continue
+                self.count('misses')
+            finally:
+                os.close(lock_fd)
+            self.evict()
+            return SourceHandle(path, 'miss', fd, self)
+
+    def evict(self):
+        """Delete least recently used entries not in use until the cache fits its byte budget"""
+        entries, total = [], 0
+        now = time.time()
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            if name.endswith('.part'):
+                if now - stat.st_mtime > STALE_PART_SECONDS:  # Left by a crashed process
+                    os.remove(path)
+                continue
+            if name.endswith('.lock'):
+                continue  # Left in place: deleting one another process holds would allow a second fill
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                fd = os.open(path, os.O_RDONLY)
+            except FileNotFoundError:
+                total -= size
+                continue
+            try:
+                if not lock(fd, fcntl.LOCK_EX, blocking=False):
+                    continue  # In use
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            finally:
+                os.close(fd)
+            total -= size
+            self.count('evictions')
+            self.count('bytes_evicted', size)
+
+    def get_stats(self):
+        entries = [name for name in os.listdir(self.directory) if not name.endswith(('.part', '.lock'))]
+        with self.stats_lock:
+            return dict(self.stats, entries=len(entries), max_bytes=self.max_bytes,
+                        bytes=sum(os.path.getsize(os.path.join(self.directory, name)) for name in entries
+                                  if os.path.exists(os.path.join(self.directory, name))))
@@ -0,0 +1,176 @@
+import json
+import threading
+
+from ai_dispatcher import AIBatchDispatcher, LocalFakeModel, extract_json
+
+
+class Usage:
+    def __init__(self, prompt_tokens, output_tokens):
+        self.prompt_token_count = prompt_tokens
+        self.candidates_token_count = output_tokens
+
+
+class RecordingModel:
+    """LocalFakeModel answers, with fixed token usage; records every prompt (and budget)"""
+    def __init__(self, usage=(0, 0)):
+        self.model = LocalFakeModel(latency=0)
+        self.usage = usage
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def generate(self, prompt, budget=None):
+        with self.lock:
+            self.calls.append((prompt, budget))
+        response = self.model.generate_content(prompt)
+        response.usage_metadata = Usage(*self.usage)
+        return response
+
+    def batch_calls(self):
+        return [prompt for prompt, _ in self.calls if 'id "' in prompt]
+
+    def individual_calls(self):
+        return [(prompt, budget) for prompt, budget in self.calls if 'id "' not in prompt]
+
+
+def submit_all(dispatcher, counts):
+    """Submit together (one batch window) and wait for every result"""
+    futures = [dispatcher.submit(count) for count in counts]
+    return [future.result(timeout=5) for future in futures]
+
+
+def test_batch_is_split_back_per_job():
+    model = RecordingModel()
+    dispatcher = AIBatchDispatcher(model.generate, window=0.2, max_items=8)
+
+    results = submit_all(dispatcher, [1, 3, 2])
+
+    assert [len(segments) for segments, _ in results] == [1, 3, 2]
+    assert len(model.batch_calls()) == 1
+    assert model.individual_calls() == []
+    stats = dispatcher.get_stats()
+    assert stats['batches'] == 1
+    assert stats['batched_items'] == 3
+    assert stats['fallbacks'] == 0
+
+
+def test_max_items_caps_a_batch():
+    model = RecordingModel()
+    dispatcher = AIBatchDispatcher(model.generate, window=0.2, max_items=2)
+
+    results = submit_all(dispatcher, [1, 1, 1, 1])
+
+    assert all(len(segments) == 1 for segments, _ in results)
+    assert len(model.batch_calls()) == 2
+
+
+def test_single_request_is_sent_on_its_own():
+    model = RecordingModel()
+    dispatcher = AIBatchDispatcher(model.generate, window=0.05)
+
+    segments, _ = dispatcher.submit(2).result(timeout=5)
+
+    assert len(segments) == 2
+    assert model.batch_calls() == []
+    assert len(model.individual_calls()) == 1
+
+
+def test_invalid_item_falls_back_to_its_own_call():
+    model = RecordingModel()
+    dispatcher = AIBatchDispatcher(model.generate, window=0.2)
+    original = model.generate
+
+    def drop_second_item(prompt, budget=None):
+        # The batch answer leaves out the second video
+        response = original(prompt, budget)
+        data = extract_json(response.text)
+        if 'items' in data:
+            data['items'] = data['items'][:1]
+            response.text = json.dumps(data)
+        return response
+    dispatcher.generate = drop_second_item
+
+    budgets = [object(), object()]
+    futures = [dispatcher.submit(count, budget) for count, budget in zip([2, 3], budgets)]
+    results = [future.result(timeout=5) for future in futures]
+
+    assert [len(segments) for segments, _ in results] == [2, 3]
+    assert len(model.batch_calls()) == 1
+    # Only the missing item is retried, with the budget its job submitted
+    fallbacks = model.individual_calls()
+    assert len(fallbacks) == 1
+    assert 'for 3 video segments' in fallbacks[0][0]
+    assert fallbacks[0][1] is budgets[1]
+    assert dispatcher.get_stats()['fallbacks'] == 1
+
+
+def test_batch_tokens_are_apportioned_by_segment_count():
+    model = RecordingModel(usage=(90, 60))
+    dispatcher = AIBatchDispatcher(model.generate, window=0.2)
+
+    results = submit_all(dispatcher, [1, 2])
+
+    assert [tokens for _, tokens in results] == [(30, 20), (60, 40)]
+
+
+def test_fallback_tokens_add_to_the_batch_share():
+    model = RecordingModel(usage=(90, 60))
+    dispatcher = AIBatchDispatcher(model.generate, window=0.2)
+    original = model.generate
+
+    def break_first_item(prompt, budget=None):
+        response = original(prompt, budget)
+        data = extract_json(response.text)
+        if 'items' in data:
+            data['items'][0]['segments'] = []
+            response.text = json.dumps(data)
+        return response
+    dispatcher.generate = break_first_item
+
+    results = submit_all(dispatcher, [1, 2])
+
+    # Its 1/3 share of the batch plus the whole individual call
+    assert results[0][1] == (30 + 90, 20 + 60)
+    assert results[1][1] == (60, 40)
+
+
+def test_failed_batch_call_fails_every_future():
+    def broken(prompt, budget=None):
+        raise RuntimeError('API down')
+    dispatcher = AIBatchDispatcher(broken, window=0.2)
+
+    futures = [dispatcher.submit(1), dispatcher.submit(1)]
+
+    for future in futures:
+        assert isinstance(future.exception(timeout=5), RuntimeError)
+
+
+def test_cancelled_request_is_not_sent():
+    model = RecordingModel()
+    dispatcher = AIBatchDispatcher(model.generate, window=0.3)
+
+    dropped = dispatcher.submit(5)
+    kept = dispatcher.submit(2)
+    assert dropped.cancel()
+
+    segments, _ = kept.result(timeout=5)
+    assert len(segments) == 2
+    # The batch shrank to the one remaining request, sent on its own
+    assert len(model.calls) == 1
+    assert 'for 2 video segments' in model.calls[0][0]
+
+
+def test_request_in_flight_cannot_be_cancelled():
+    release = threading.Event()
+    started = threading.Event()
+
+    def slow(prompt, budget=None):
+        started.set()
+        release.wait(5)
+        return LocalFakeModel(latency=0).generate_content(prompt)
+    dispatcher = AIBatchDispatcher(slow, window=0.01)
+
+    future = dispatcher.submit(1)
+    assert started.wait(5)
+    assert not future.cancel()
+    release.set()
+    assert len(future.result(timeout=5)[0]) == 1
@@ -0,0 +1,125 @@
+import time
+
+import pytest
+
+from job_queue import CANCELLED, DONE, FAILED, LEASED, QUEUED, SQLiteJobQueue
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return SQLiteJobQueue(str(tmp_path / 'jobs.sqlite3'))
+
+
+def test_lease_takes_oldest_job_once(queue):
+    first = queue.enqueue('process_video', {'n': 1})
+    second = queue.enqueue('process_video', {'n': 2})
+
+    job = queue.lease('w1', 60)
+    assert job['id'] == first
+    assert job['state'] == LEASED
+    assert job['worker'] == 'w1'
+    assert job['attempts'] == 1
+    assert job['payload'] == {'n': 1}
+
+    assert queue.lease('w2', 60)['id'] == second
+    assert queue.lease('w3', 60) is None
+
+
+def test_complete_stores_result(queue):
+    job_id = queue.enqueue('process_video', {})
+    queue.lease('w1', 60)
+
+    assert queue.complete(job_id, 'w1', {'status': 200})
+    job = queue.get(job_id)
+    assert job['state'] == DONE
+    assert job['result'] == {'status': 200}
+    assert queue.lease('w2', 60) is None
+
+
+def test_expired_lease_is_retried_by_another_worker(queue):
+    job_id = queue.enqueue('process_video', {}, max_attempts=3)
+    queue.lease('w1', 0.05)
+    time.sleep(0.1)
+
+    job = queue.lease('w2', 60)
+    assert job['id'] == job_id
+    assert job['worker'] == 'w2'
+    assert job['attempts'] == 2
+    # The first worker lost the job: it can neither extend nor finish it
+    assert not queue.heartbeat(job_id, 'w1', 60)
+    assert not queue.complete(job_id, 'w1', {'status': 200})
+    assert queue.heartbeat(job_id, 'w2', 60)
+
+
+def test_heartbeat_keeps_lease(queue):
+    job_id = queue.enqueue('process_video', {})
+    queue.lease('w1', 0.2)
+    time.sleep(0.1)
+    assert queue.heartbeat(job_id, 'w1', 60)
+    time.sleep(0.15)
+    assert queue.lease('w2', 60) is None
+
+
+def test_expired_lease_on_final_attempt_fails(queue):
+    job_id = queue.enqueue('process_video', {}, max_attempts=1)
+    queue.lease('w1', 0.05)
+    time.sleep(0.1)
+
+    assert queue.lease('w2', 60) is None
+    job = queue.get(job_id)
+    assert job['state'] == FAILED
+    assert job['error'] == 'Lease expired on final attempt'
+
+
+def test_fail_retries_until_max_attempts(queue):
+    job_id = queue.enqueue('process_video', {}, max_attempts=2)
+    queue.lease('w1', 60)
+    assert queue.fail(job_id, 'w1', 'ffmpeg crashed')
+    assert queue.get(job_id)['state'] == QUEUED
+
+    assert queue.lease('w2', 60)['attempts'] == 2
+    assert queue.fail(job_id, 'w2', 'ffmpeg crashed again')
+    job = queue.get(job_id)
+    assert job['state'] == FAILED
+    assert job['error'] == 'ffmpeg crashed again'
+    assert queue.lease('w3', 60) is None
+
+
+def test_cancel_queued_job(queue):
+    job_id = queue.enqueue('process_video', {})
+
+    assert queue.cancel(job_id) == CANCELLED
+    assert queue.lease('w1', 60) is None
+    assert queue.cancel('no-such-job') is None
+
+
+def test_cancel_leased_job_goes_through_worker(queue):
+    job_id = queue.enqueue('process_video', {})
+    queue.lease('w1', 60)
+    assert not queue.cancel_requested(job_id)
+
+    assert queue.cancel(job_id) == LEASED
+    assert queue.cancel_requested(job_id)
+    assert queue.mark_cancelled(job_id, 'w1', {'cancelled': True})
+    job = queue.get(job_id)
+    assert job['state'] == CANCELLED
+    assert job['result'] == {'cancelled': True}
+
+
+def test_cancel_requested_job_is_not_retried_after_expiry(queue):
+    job_id = queue.enqueue('process_video', {}, max_attempts=3)
+    queue.lease('w1', 0.05)
+    queue.cancel(job_id)
+    time.sleep(0.1)
+
+    assert queue.lease('w2', 60) is None
+    assert queue.get(job_id)['state'] == CANCELLED
+
+
+def test_finished_job_cannot_be_cancelled(queue):
+    job_id = queue.enqueue('process_video', {})
+    queue.lease('w1', 60)
+    queue.complete(job_id, 'w1', {'status': 200})
+
+    assert queue.cancel(job_id) == DONE
+    assert queue.get(job_id)['state'] == DONE
@@ -0,0 +1,177 @@
+import io
+import struct
+
+import pytest
+
+import preflight
+from preflight import PreflightError, S3RangeReader, plan_cut_points, probe_mp4, sniff_streamable
+
+
+# Minimal ISO-BMFF writer: just the boxes preflight reads
+
+def box(box_type, payload=b''):
+    return struct.pack('>I4s', 8 + len(payload), box_type) + payload
+
+
+def full_box(box_type, payload, version=0):
+    return box(box_type, bytes([version, 0, 0, 0]) + payload)
+
+
+def trak(handler, timescale, duration, stts, stss=None, ctts=None, elst=None, codec=b'avc1'):
+    tkhd = full_box(b'tkhd', struct.pack('>III', 0, 0, 1) + bytes(60) + struct.pack('>II', 640 << 16, 360 << 16))
+    mdhd = full_box(b'mdhd', struct.pack('>IIII', 0, 0, timescale, duration) + bytes(4))
+    hdlr = full_box(b'hdlr', bytes(4) + handler + bytes(12))
+    stsd = full_box(b'stsd', struct.pack('>I', 1) + struct.pack('>I4s', 16, codec) + bytes(8))
+    tables = [stsd, full_box(b'stts', struct.pack('>I', len(stts)) +
+                             b''.join(struct.pack('>II', *entry) for entry in stts))]
+    if stss is not None:
+        tables.append(full_box(b'stss', struct.pack('>I', len(stss)) +
+                               b''.join(struct.pack('>I', n) for n in stss)))
+    if ctts is not None:
+        tables.append(full_box(b'ctts', struct.pack('>I', len(ctts)) +
+                               b''.join(struct.pack('>Ii', *entry) for entry in ctts)))
+    tables.append(full_box(b'stsz', struct.pack('>II', 0, sum(count for count, _ in stts))))
+    children = [tkhd]
+    if elst is not None:
+        children.append(box(b'edts', full_box(b'elst', struct.pack('>I', len(elst)) + b''.join(
+            struct.pack('>Iii', duration, media_time, 1 << 16) for duration, media_time in elst))))
+    children.append(box(b'mdia', mdhd + hdlr + box(b'minf', box(b'stbl', b''.join(tables)))))
+    return box(b'trak', b''.join(children))
+
+
+def video_trak(**kwargs):
+    # 10s at 30 fps, a keyframe every 2s
+    return trak(b'vide', 30, 300, [(300, 1)], stss=[1, 61, 121, 181, 241], **kwargs)
+
+
+def audio_trak():
+    return trak(b'soun', 1000, 10000, [(10, 1000)], codec=b'mp4a')
+
+
+def mp4(traks, faststart=True, mdat=b'\0' * 64, extra_boxes=b''):
+    ftyp = box(b'ftyp', b'isom' + struct.pack('>I', 512) + b'isomiso2avc1mp41')
+    moov = box(b'moov', full_box(b'mvhd', struct.pack('>IIII', 0, 0, 1000, 10000) + bytes(80)) + b''.join(traks))
+    if faststart:
+        return ftyp + moov + box(b'mdat', mdat) + extra_boxes
+    return ftyp + extra_boxes + box(b'mdat', mdat) + moov
+
+
+class BytesReader:
+    def __init__(self, data):
+        self.data = data
+        self.size = len(data)
+
+    def read(self, offset, length):
+        return self.data[offset:offset + length]
+
+
+class FakeS3:
+    def __init__(self, data):
+        self.data = data
+        self.gets = 0
+
+    def head_object(self, Bucket, Key):
+        return {'ContentLength': len(self.data)}
+
+    def get_object(self, Bucket, Key, Range):
+        self.gets += 1
+        start, end = map(int, Range[len('bytes='):].split('-'))
+        return {'Body': io.BytesIO(self.data[start:end + 1])}
+
+
+def probe(data, segment_duration=None):
+    return probe_mp4(BytesReader(data), segment_duration)
+
+
+def test_probe_reads_tracks_and_keyframes():
+    info = probe(mp4([video_trak(), audio_trak()]), segment_duration=4)
+
+    assert info['duration'] == 10
+    assert info['faststart']
+    assert info['major_brand'] == 'isom'
+    video, audio = info['tracks']
+    assert (video['type'], video['codec'], video['width'], video['height']) == ('video', 'avc1', 640, 360)
+    assert video['keyframe_times'] == [0.0, 2.0, 4.0, 6.0, 8.0]
+    assert (audio['type'], audio['codec'], audio['keyframe_times']) == ('audio', 'mp4a', None)
+    assert info['cut_points'] == [0.0, 4.0, 8.0]
+
+
+def test_keyframe_times_are_presentation_times():
+    # B-frames: two frames of composition delay, no edit list to remove it
+    info = probe(mp4([video_trak(ctts=[(300, 2)]), audio_trak()]))
+    assert info['tracks'][0]['keyframe_times'] == [0.067, 2.067, 4.067, 6.067, 8.067]
+
+    # The usual encoder output: an edit list trims the delay back off
+    info = probe(mp4([video_trak(ctts=[(300, 2)], elst=[(10000, 2)]), audio_trak()]))
+    assert info['tracks'][0]['keyframe_times'] == [0.0, 2.0, 4.0, 6.0, 8.0]
+
+    # A leading empty edit delays the track (movie timescale: 500/1000 s)
+    info = probe(mp4([video_trak(elst=[(500, -1), (10000, 0)]), audio_trak()]))
+    assert info['tracks'][0]['keyframe_times'] == [0.5, 2.5, 4.5, 6.5, 8.5]
+
+
+def test_plan_cut_points_uses_absolute_boundaries():
+    assert plan_cut_points([0.0, 1.9, 2.5, 3.9, 4.1, 9.0], 2) == [0.0, 2.5, 4.1, 9.0]
+
+
+def test_moov_after_mdat_is_not_faststart():
+    assert not probe(mp4([video_trak()], faststart=False))['faststart']
+
+
+def test_not_iso_bmff_is_left_to_ffprobe():
+    assert probe(b'\x1a\x45\xdf\xa3' + bytes(100)) is None
+
+
+def test_truncated_mdat_is_rejected():
+    data = mp4([video_trak()], mdat=b'\0' * 1000)
+    with pytest.raises(PreflightError, match='Truncated'):
+        probe(data[:-100])
+
+
+def test_missing_moov_is_rejected():
+    data = mp4([video_trak()])
+    ftyp_size = struct.unpack_from('>I', data)[0]
+    with pytest.raises(PreflightError, match='No moov'):
+        probe(data[:ftyp_size] + box(b'mdat', b'\0' * 64))
+
+
+def test_audio_only_is_rejected():
+    with pytest.raises(PreflightError, match='No video'):
+        probe(mp4([audio_trak()]))
+
+
+def test_corrupt_sample_table_is_rejected():
+    data = bytearray(mp4([video_trak()]))
+    stss = data.index(b'stss')
+    struct.pack_into('>I', data, stss + 8, 100000)  # entry count far past the box
+    with pytest.raises(PreflightError):
+        probe(bytes(data))
+
+
+def test_oversized_moov_is_left_to_ffprobe(monkeypatch):
+    monkeypatch.setattr(preflight, 'MAX_MOOV_SIZE', 100)
+    assert probe(mp4([video_trak()])) is None
+
+
+def test_too_many_boxes_before_moov_is_left_to_ffprobe():
+    fragments = b''.join(box(b'moof', bytes(16)) + box(b'mdat', bytes(16)) for _ in range(40))
+    assert probe(mp4([video_trak()], faststart=False, extra_boxes=fragments)) is None
+
+
+def test_s3_walk_stops_after_moov():
+    # Thousands of fragments after the moov must not cost a GET each
+    fragments = b''.join(box(b'moof', bytes(16)) + box(b'mdat', bytes(100000)) for _ in range(500))
+    client = FakeS3(mp4([video_trak()], extra_boxes=fragments))
+
+    info = preflight.preflight_s3_object(client, 'bucket', 'key')
+
+    assert info['duration'] == 10
+    assert client.gets <= 3
+
+
+def test_sniff_streamable():
+    assert sniff_streamable(b'\x1a\x45\xdf\xa3' + bytes(100)) == 'matroska'
+    assert sniff_streamable(bytes([0x47]) + bytes(187) + bytes([0x47]) + bytes(187) + bytes([0x47])) == 'mpegts'
+    assert sniff_streamable(mp4([video_trak()])) is False
+    assert sniff_streamable(b'RIFF' + bytes(100)) is False
+    assert sniff_streamable(b'\x1a\x45') is None
@@ -0,0 +1,97 @@
+"""Processing worker: leases jobs from the shared queue and runs them.
+
+    JOB_QUEUE_BACKEND=redis JOB_QUEUE_URL=redis://... python -m worker
+
+Run as many as the node's cores allow, on as many nodes as needed; web
+nodes only enqueue (see JOB_QUEUE_BACKEND in app.py).
+"""
+import os
+import socket
+import threading
+import time
+
+from cancellation import CANCEL_POLL_INTERVAL, CancelToken
+from app import (
+    job_queue, is_valid_session_id, run_processing_job, run_with_accounting, start_cleanup_thread,
+    JOB_QUEUE_BACKEND, JOB_VISIBILITY_TIMEOUT
+)
+
+POLL_INTERVAL = float(os.getenv('WORKER_POLL_INTERVAL', 1))
+
+
+def process_video(payload, token):
+    # The session id names the job's directories, so re-check whatever was queued
+    if not is_valid_session_id(payload.get('session_id')):
+        return {'error': 'Invalid session id'}, 400
+    return run_with_accounting(
+        run_processing_job, payload['object_name'], payload['session_id'],
+        payload.get('renditions'), payload.get('output_mode', 'zip'), payload.get('preflight'),
+        payload.get('keyframe_times'), profile=payload.get('profile', False), token=token
+    )
+
+
+JOB_HANDLERS = {
+    'process_video': process_video
+}
+
+
+def keep_lease(job_id, worker_id, stop, token):
+    """Heartbeat the lease until the job finishes; cancel the job when DELETE /jobs/<id> asks to
+    or the lease is lost"""
+    next_heartbeat = time.monotonic() + JOB_VISIBILITY_TIMEOUT / 3
+    while not stop.wait(min(CANCEL_POLL_INTERVAL, JOB_VISIBILITY_TIMEOUT / 3)):
+        if not token.cancelled and job_queue.cancel_requested(job_id):
+            print(f"Cancelling job {job_id}")
+            token.cancel('cancelled via API')
+        if time.monotonic() >= next_heartbeat:
+            next_heartbeat = time.monotonic() + JOB_VISIBILITY_TIMEOUT / 3
+            if not job_queue.heartbeat(job_id, worker_id, JOB_VISIBILITY_TIMEOUT):
+                # Another worker may lease it again: stop ours rather than process it twice
+                print(f"Lost lease on job {job_id}, cancelling it")
+                token.cleanups.clear()  # Its files may already belong to that worker (same session id)
+                token.cancel('lease lost')
+                return
+
+
+def run_job(job, worker_id):
+    """Run one leased job and record its outcome"""
+    stop = threading.Event()
+    token = CancelToken()
+    heartbeat = threading.Thread(target=keep_lease, args=(job['id'], worker_id, stop, token), daemon=True)
+    heartbeat.start()
+    try:
+        result, status = JOB_HANDLERS[job['kind']](job['payload'], token)
+        if result.get('cancelled'):
+            job_queue.mark_cancelled(job['id'], worker_id, dict(result, status=status))
+        elif status >= 500:
+            # Server-side failure (storage, ffmpeg crash...): retry elsewhere
+            job_queue.fail(job['id'], worker_id, result.get('error', f'HTTP {status}'))
+        else:
+            job_queue.complete(job['id'], worker_id, dict(result, status=status))
+    except Exception as e:
+        print(f"Job {job['id']} error: {e}")
+        job_queue.fail(job['id'], worker_id, str(e))
+    finally:
+        stop.set()
+        heartbeat.join()
+
+
+def main():
+    if not job_queue:
+        raise SystemExit('Set JOB_QUEUE_BACKEND (sqlite or redis) to run a worker')
+
+    worker_id = f"{socket.gethostname()}-{os.getpid()}"
+    start_cleanup_thread()
+    print(f"👷 Worker {worker_id} polling {JOB_QUEUE_BACKEND} queue")
+
+    while True:
+        job = job_queue.lease(worker_id, JOB_VISIBILITY_TIMEOUT)
+        if not job:
+            time.sleep(POLL_INTERVAL)
+            continue
+        print(f"Job {job['id']} ({job['kind']}) attempt {job['attempts']}/{job['max_attempts']}")
+        run_job(job, worker_id)
+
+
+if __name__ == '__main__':
+    main()